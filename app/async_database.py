@@ -0,0 +1,153 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from . import database, deadline
+from .metrics import db_query_seconds
+
+# Чтения идут параллельно (WAL допускает несколько читателей), записи
+# выстраиваются в один поток, чтобы не бороться за блокировку SQLite.
+DB_READ_WORKERS = 4
+
+_read_executor = ThreadPoolExecutor(max_workers=DB_READ_WORKERS, thread_name_prefix="db-read")
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+
+
+def _timed(kind: str, func, args, kwargs):
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        db_query_seconds.labels(func.__name__, kind).observe(time.perf_counter() - started)
+
+
+async def run_read(func, *args, **kwargs):
+    """Выполняет читающую функцию БД в пуле читателей"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_read_executor, _timed, "read", func, args, kwargs)
+
+
+async def run_write(func, *args, **kwargs):
+    """Выполняет пишущую функцию БД в потоке-писателе.
+
+    Ожидание ограничено бюджетом запроса (DeadlineExceeded), но сама запись
+    не отменяется и завершится в потоке-писателе.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_write_executor, _timed, "write", func, args, kwargs)
+    return await deadline.wait_for(asyncio.shield(future), "db_write")
+
+
+def shutdown():
+    """Дожидается завершения запросов и останавливает пулы"""
+    _write_executor.shutdown(wait=True)
+    _read_executor.shutdown(wait=True)
+
+
+async def create_user_simple(login: str, password: str):
+    return await run_write(database.create_user_simple, login, password)
+
+
+async def check_user_simple(login: str, password: str):
+    return await run_read(database.check_user_simple, login, password)
+
+
+async def save_track(user_id: int, title: str, artist: str, is_original: bool,
+                     shazam_url: Optional[str] = None, platform_links=None):
+    return await run_write(database.save_track, user_id, title, artist, is_original,
+                           shazam_url, platform_links)
+
+
+async def save_tracks(tracks):
+    return await run_write(database.save_tracks, tracks)
+
+
+async def get_user_tracks(user_id: int):
+    return await run_read(database.get_user_tracks, user_id)
+
+
+async def get_users_after(after_id: int, limit: int):
+    return await run_read(database.get_users_after, after_id, limit)
+
+
+async def get_user_by_login(login: str):
+    return await run_read(database.get_user_by_login, login)
+
+
+async def get_all_discussions(cursor: Optional[str] = None, direction: str = "next",
+        limit: int = database.PAGE_SIZE):
+    return await run_read(database.get_all_discussions, cursor, direction, limit)
+
+
+async def get_discussion_stats():
+    return await run_read(database.get_discussion_stats)
+
+
+async def create_discussion(track_id: int, created_by: int, title: str):
+    return await run_write(database.create_discussion, track_id, created_by, title)
+
+
+async def get_discussion(discussion_id: int):
+    return await run_read(database.get_discussion, discussion_id)
+
+
+async def get_comments(discussion_id: int, cursor: Optional[str] = None, direction: str = "next",
+        limit: int = database.PAGE_SIZE):
+    return await run_read(database.get_comments, discussion_id, cursor, direction, limit)
+
+
+async def insert_batch(tracks, comments):
+    return await run_write(database.insert_batch, tracks, comments)
+
+
+async def add_comment(discussion_id: int, user_id: int, content: str):
+    return await run_write(database.add_comment, discussion_id, user_id, content)
+
+
+async def get_all_comments(cursor: Optional[str] = None, direction: str = "next",
+        limit: int = database.PAGE_SIZE):
+    return await run_read(database.get_all_comments, cursor, direction, limit)
+
+
+async def delete_comment(comment_id: int):
+    return await run_write(database.delete_comment, comment_id)
+
+
+async def search_local(query: str, limit: int = 20):
+    return await run_read(database.search_local, query, limit)
+
+
+async def create_job(job_id: str, file_path: str, content_hash: str, username: Optional[str],
+                     owner: str, lease_until: float):
+    return await run_write(database.create_job, job_id, file_path, content_hash, username,
+                           owner, lease_until)
+
+
+async def claim_job(job_id: str, owner: str):
+    return await run_write(database.claim_job, job_id, owner)
+
+
+async def renew_job_leases(owner: str, lease_until: float):
+    return await run_write(database.renew_job_leases, owner, lease_until)
+
+
+async def release_job_leases(owner: str, job_id: Optional[str] = None):
+    return await run_write(database.release_job_leases, owner, job_id)
+
+
+async def take_over_stale_jobs(owner: str, lease_until: float, now: float, limit: int):
+    return await run_write(database.take_over_stale_jobs, owner, lease_until, now, limit)
+
+
+async def prune_jobs(retention_seconds: float):
+    return await run_write(database.prune_jobs, retention_seconds)
+
+
+async def update_job(job_id: str, status: str, stage: str,
+                     result: Optional[str] = None, error: Optional[str] = None):
+    return await run_write(database.update_job, job_id, status, stage, result, error)
+
+
+async def get_job(job_id: str):
+    return await run_read(database.get_job, job_id)
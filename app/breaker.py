@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .metrics import counter, gauge_callback
+
+logger = logging.getLogger(__name__)
+
+# Предохранитель размыкается, если за последние BREAKER_WINDOW секунд было
+# не меньше BREAKER_MIN_CALLS вызовов и доля ошибок или медленных вызовов
+# достигла порога. Через BREAKER_OPEN_SECONDS пропускаются пробные вызовы:
+# успех замыкает цепь, ошибка снова размыкает.
+BREAKER_WINDOW = 60.0
+BREAKER_MIN_CALLS = 5
+BREAKER_ERROR_RATE = 0.5
+BREAKER_SLOW_RATE = 0.8
+BREAKER_OPEN_SECONDS = 30.0
+BREAKER_HALF_OPEN_CALLS = 1
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+transitions = counter(
+    "soundhome_breaker_transitions_total",
+    "Переключения предохранителей внешних сервисов",
+    ["breaker", "state"],
+)
+rejected_calls = counter(
+    "soundhome_breaker_rejected_total",
+    "Вызовы, отклонённые разомкнутым предохранителем",
+    ["breaker"],
+)
+
+breakers: List["CircuitBreaker"] = []
+
+
+class CircuitOpen(Exception):
+    """Предохранитель разомкнут: вызов отклонён без обращения к сервису"""
+
+
+class CircuitBreaker:
+    """Предохранитель внешнего сервиса по скользящей доле ошибок и задержке.
+
+    Потокобезопасен: поиск вызывается из пула потоков, Shazam — из цикла
+    событий.
+    """
+
+    def __init__(self, name: str, slow_call_seconds: float,
+                 window: float = BREAKER_WINDOW,
+                 min_calls: int = BREAKER_MIN_CALLS,
+                 error_rate: float = BREAKER_ERROR_RATE,
+                 slow_rate: float = BREAKER_SLOW_RATE,
+                 open_seconds: float = BREAKER_OPEN_SECONDS,
+                 half_open_calls: int = BREAKER_HALF_OPEN_CALLS):
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        # (время завершения, ошибка, медленный)
+        self._calls: "deque[Tuple[float, bool, bool]]" = deque()
+        self._lock = threading.Lock()
+        self._rejected = rejected_calls.labels(breaker=name)
+        breakers.append(self)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._switch(HALF_OPEN)
+        return self._state
+
+    def _switch(self, state: str) -> None:
+        if state == self._state:
+            return
+        logger.warning(f"Предохранитель {self.name}: {self._state} -> {state}")
+        self._state = state
+        self._probes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._calls.clear()
+        transitions.inc(breaker=self.name, state=state)
+
+    def before_call(self) -> None:
+        """Пропускает вызов или поднимает CircuitOpen"""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return
+        self._rejected.inc()
+        raise CircuitOpen(f"{self.name}: сервис временно отключён")
+
+    def release(self) -> None:
+        """Возвращает слот пробного вызова, который так и не дошёл до сервиса"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record(self, failed: bool, seconds: float) -> None:
+        """Учитывает завершённый вызов и переключает состояние"""
+        now = time.monotonic()
+        slow = seconds >= self.slow_call_seconds
+        with self._lock:
+            state = self._current_state(now)
+            if state == HALF_OPEN:
+                self._switch(OPEN if failed or slow else CLOSED)
+                return
+            if state == OPEN:
+                return
+
+            self._calls.append((now, failed, slow))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            failures = sum(1 for _, f, _ in self._calls if f)
+            slow_calls = sum(1 for _, _, s in self._calls if s)
+            if failures / total >= self.error_rate or slow_calls / total >= self.slow_rate:
+                self._switch(OPEN)
+
+    async def acall(self, func: Callable[..., Awaitable[Any]], *args,
+                    timeout: Optional[float] = None, **kwargs) -> Any:
+        """Вызывает корутину через предохранитель.
+
+        timeout ограничивает вызов внутри предохранителя: зависший сервис
+        учитывается как ошибка, а не как отменённый вызов.
+        """
+        self.before_call()
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+        except Exception:
+            self.record(True, time.perf_counter() - started)
+            raise
+        except BaseException:
+            # Отменённый вызов ничего не говорит о состоянии сервиса
+            self.release()
+            raise
+        self.record(False, time.perf_counter() - started)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            recent = [call for call in self._calls if call[0] >= now - self.window]
+            retry_in: Optional[float] = None
+            if state == OPEN:
+                retry_in = round(max(0.0, self.open_seconds - (now - self._opened_at)), 1)
+        return {
+            "state": state,
+            "calls": len(recent),
+            "errors": sum(1 for _, failed, _ in recent if failed),
+            "slow": sum(1 for _, _, slow in recent if slow),
+            "retry_in_seconds": retry_in,
+        }
+
+
+def breaker_stats() -> Dict[str, Dict[str, Any]]:
+    return {breaker.name: breaker.stats() for breaker in breakers}
+
+
+gauge_callback(
+    "soundhome_breaker_state",
+    "Состояние предохранителя: 0 — замкнут, 1 — пробные вызовы, 2 — разомкнут",
+    ["breaker"],
+    lambda: [((breaker.name,), STATE_CODES[breaker.state]) for breaker in breakers],
+)
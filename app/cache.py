@@ -0,0 +1,197 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from sqlite3 import Error
+from typing import Any, Dict, Optional, Set, Tuple
+
+from . import deadline
+from .async_database import run_read, run_write
+from .database import db_connection
+from .metrics import cache_requests
+
+MISSING = object()
+
+# Чтение кэша в пуле читателей только SELECT: отметки accessed_at и удаление
+# устаревших строк копятся в памяти и пишутся потоком-писателем — вместе со
+# следующей записью в кэш или отдельной пачкой, когда их набралось столько
+CACHE_MAINTENANCE_BATCH = 256
+
+
+class ResultCache:
+    """LRU-кэш в памяти поверх таблицы cache_entries в SQLite"""
+
+    def __init__(self, namespace: str, ttl: float, negative_ttl: float,
+                 max_memory_entries: int = 1024, max_db_entries: int = 50000):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_db_entries = max_db_entries
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._touched: Dict[str, float] = {}
+        self._expired: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._memory_hits = cache_requests.labels(cache=namespace, result="memory_hit")
+        self._db_hits = cache_requests.labels(cache=namespace, result="db_hit")
+        self._misses = cache_requests.labels(cache=namespace, result="miss")
+
+    async def aget(self, key: str, default: Any = MISSING) -> Any:
+        """Возвращает значение из кэша или default, если записи нет или она устарела.
+
+        Обращение к SQLite выполняется в пуле читателей БД.
+        """
+        now = time.time()
+        value = self._recall(key, now)
+        if value is not MISSING:
+            return value
+        value = await run_read(self._load_and_remember, key, now, default)
+        if self._maintenance_due():
+            self._flush_task = asyncio.create_task(self._aflush_maintenance())
+        return value
+
+    async def aset(self, key: str, value: Any) -> None:
+        """Сохраняет значение; None кэшируется на negative_ttl.
+
+        Запись в SQLite выполняется в потоке-писателе БД.
+        """
+        expires_at = self._expires_at(value)
+        self._remember(key, expires_at, value)
+        await run_write(self._store, key, expires_at, value)
+
+    def _expires_at(self, value: Any) -> float:
+        ttl = self.negative_ttl if value is None else self.ttl
+        return time.time() + ttl
+
+    def _recall(self, key: str, now: float) -> Any:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self._memory_hits.inc()
+                return value
+            del self._memory[key]
+            return MISSING
+
+    def _load_and_remember(self, key: str, now: float, default: Any) -> Any:
+        row = self._load(key, now)
+        if row is None:
+            self._misses.inc()
+            return default
+        self._db_hits.inc()
+        expires_at, value = row
+        self._remember(key, expires_at, value)
+        return value
+
+    def _remember(self, key: str, expires_at: float, value: Any) -> None:
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _load(self, key: str, now: float) -> Optional[Tuple[float, Any]]:
+        try:
+            with db_connection() as conn:
+                row = conn.execute(
+                    """SELECT value, expires_at FROM cache_entries
+                    WHERE namespace = ? AND key = ?""",
+                    (self.namespace, key)
+                ).fetchone()
+        except Error as e:
+            print(f"Ошибка чтения кэша: {e}")
+            return None
+        if row is None:
+            return None
+        with self._lock:
+            if row["expires_at"] <= now:
+                self._expired.add(key)
+                return None
+            self._touched[key] = now
+        return row["expires_at"], json.loads(row["value"])
+
+    def _maintenance_due(self) -> bool:
+        with self._lock:
+            pending = len(self._touched) + len(self._expired)
+        running = self._flush_task is not None and not self._flush_task.done()
+        return pending >= CACHE_MAINTENANCE_BATCH and not running
+
+    async def _aflush_maintenance(self) -> None:
+        # Фоновая пачка не относится к запросу, во время которого набралась
+        with deadline.until(None):
+            await run_write(self._flush_maintenance)
+
+    def _flush_maintenance(self) -> None:
+        try:
+            with db_connection() as conn:
+                self._apply_maintenance(conn, time.time())
+        except Error as e:
+            print(f"Ошибка обслуживания кэша: {e}")
+
+    def _apply_maintenance(self, conn, now: float) -> None:
+        """Пишет накопленные отметки доступа и удаляет устаревшие строки"""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            expired, self._expired = self._expired, set()
+        if touched:
+            conn.executemany(
+                """UPDATE cache_entries SET accessed_at = ?
+                WHERE namespace = ? AND key = ?""",
+                [(accessed_at, self.namespace, key) for key, accessed_at in touched.items()]
+            )
+        if expired:
+            # Ключ могли уже перезаписать свежим значением — его не трогаем
+            conn.executemany(
+                """DELETE FROM cache_entries
+                WHERE namespace = ? AND key = ? AND expires_at <= ?""",
+                [(self.namespace, key, now) for key in expired]
+            )
+
+    def _store(self, key: str, expires_at: float, value: Any) -> None:
+        now = time.time()
+        try:
+            with db_connection() as conn:
+                self._apply_maintenance(conn, now)
+                conn.execute(
+                    """INSERT OR REPLACE INTO cache_entries
+                    (namespace, key, value, expires_at, accessed_at)
+                    VALUES (?, ?, ?, ?, ?)""",
+                    (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at, now)
+                )
+                self._writes += 1
+                if self._writes % 100 == 0:
+                    self._evict(conn, now)
+        except Error as e:
+            print(f"Ошибка записи кэша: {e}")
+
+    def _evict(self, conn, now: float) -> None:
+        conn.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?",
+            (self.namespace, now)
+        )
+        conn.execute(
+            """DELETE FROM cache_entries WHERE namespace = ? AND key IN (
+                SELECT key FROM cache_entries WHERE namespace = ?
+                ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.namespace, self.namespace, self.max_db_entries)
+        )
+
+
+search_cache = ResultCache(
+    "search",
+    ttl=7 * 24 * 3600,
+    negative_ttl=6 * 3600,
+)
+
+recognition_cache = ResultCache(
+    "recognition",
+    ttl=30 * 24 * 3600,
+    negative_ttl=3600,
+)
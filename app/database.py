@@ -1,332 +1,590 @@
+import base64
+import json
+import os
+import re
 import sqlite3
+import threading
+from contextlib import contextmanager
 from sqlite3 import Error
 from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
 
+from .migrations import apply_migrations
+from .normalize import normalize_key
 
-def get_db_connection():
-    conn = None
+DB_PATH = os.getenv("SOUNDHOME_DB", "music_db.sqlite")
+BUSY_TIMEOUT_MS = 5000
+
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+]
+
+PAGE_SIZE = 50
+
+# Маркеры подсветки в snippet(): управляющие символы не встречаются в тексте,
+# поэтому фрагмент можно безопасно экранировать и затем заменить маркеры тегами
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+SNIPPET_TOKENS = 12
+
+_WORD_RE = re.compile(r"\w+")
+
+_local = threading.local()
+
+
+# Строка находки: (user_id, title, artist, is_original[, shazam_url[, platform_links]])
+TrackRow = Tuple[Any, ...]
+
+
+class Page(NamedTuple):
+    items: List[sqlite3.Row]
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+
+
+def encode_cursor(created_at: str, row_id: int) -> str:
+    """Кодирует позицию (created_at, id) в непрозрачный курсор для URL"""
+    raw = f"{created_at}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Разбирает курсор; для пустого или испорченного возвращает None"""
+    if not cursor:
+        return None
     try:
-        conn = sqlite3.connect('music_db.sqlite')
-        conn.row_factory = sqlite3.Row  
-        print("Подключение к SQLite успешно!")
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit("|", 1)
+        return created_at, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def get_db_connection():
+    """Возвращает соединение текущего потока, открывая его при первом обращении"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
         return conn
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
     except Error as e:
         print(f"Ошибка подключения: {e}")
         raise
+    _local.conn = conn
+    return conn
 
 
-def init_db():
-    commands = [
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            login TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            is_admin BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS tracks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            artist TEXT NOT NULL,
-            genre TEXT,
-            is_original BOOLEAN DEFAULT FALSE,
-            found_by INTEGER NOT NULL,
-            found_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (found_by) REFERENCES users(id)
-        );
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS discussions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            track_id INTEGER NOT NULL,
-            created_by INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (track_id) REFERENCES tracks(id),
-            FOREIGN KEY (created_by) REFERENCES users(id)
-        );
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS comments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            discussion_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            content TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (discussion_id) REFERENCES discussions(id),
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        );
-        """
-    ]
-    
+@contextmanager
+def db_connection():
+    """Соединение потока: коммит при успешном выходе, откат при ошибке"""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    for command in commands:
-        cursor.execute(command)
-    conn.commit()
-    conn.close()
-    print("Таблицы созданы!")
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def fetch_page(conn, sql: str, params: tuple, order_columns: Tuple[str, str],
+               cursor: Optional[str] = None, direction: str = "next",
+               limit: int = PAGE_SIZE) -> Page:
+    """Keyset-пагинация по (created_at, id) от новых к старым.
+
+    sql должен содержать плейсхолдеры {where} и {order}; direction="next"
+    листает к более старым записям, "prev" — к более новым.
+    """
+    created_col, id_col = order_columns
+    position = decode_cursor(cursor)
+    backwards = direction == "prev" and position is not None
+
+    where = "1"
+    if position is not None:
+        where = f"({created_col}, {id_col}) {'>' if backwards else '<'} (?, ?)"
+        params = params + position
+    order = f"{created_col} {'ASC' if backwards else 'DESC'}, {id_col} {'ASC' if backwards else 'DESC'}"
+
+    rows = conn.execute(
+        sql.format(where=where, order=order) + " LIMIT ?",
+        params + (limit + 1,)
+    ).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return Page([], None, None)
+
+    first = encode_cursor(rows[0]["created_at"], rows[0]["id"])
+    last = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    if backwards:
+        return Page(rows, last, first if has_more else None)
+    return Page(rows, last if has_more else None, first if position is not None else None)
+
+
+def init_db():
+    """Приводит схему базы к последней версии"""
+    with db_connection() as conn:
+        version = apply_migrations(conn)
+    print(f"Схема базы данных: версия {version}")
 
 def create_user_simple(login: str, password: str):
     """Простая регистрация пользователя"""
-    conn = get_db_connection()
     try:
-        conn.execute(
-            "INSERT INTO users (login, password, username) VALUES (?, ?, ?)",
-            (login, password, f"user_{login}")  
-        )
-        conn.commit()
+        with db_connection() as conn:
+            conn.execute(
+                "INSERT INTO users (login, password, username) VALUES (?, ?, ?)",
+                (login, password, f"user_{login}")  
+            )
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def check_user_simple(login: str, password: str):
     """Простая проверка авторизации"""
-    conn = get_db_connection()
-    user = conn.execute(
-        "SELECT * FROM users WHERE login = ? AND password = ?",
-        (login, password)
-    ).fetchone()
-    conn.close()
-    return user
-
-def save_track(user_id: int, title: str, artist: str, is_original: bool):
-    """Сохраняет найденный трек в базу данных"""
-    conn = get_db_connection()
+    with db_connection() as conn:
+        return conn.execute(
+            "SELECT * FROM users WHERE login = ? AND password = ?",
+            (login, password)
+        ).fetchone()
+
+def _catalog_row(user_id: int, title: str, artist: str, is_original: bool,
+                 shazam_url: Optional[str] = None,
+                 platform_links: Optional[Sequence[Dict[str, str]]] = None):
+    links = json.dumps(list(platform_links), ensure_ascii=False) if platform_links else None
+    key = normalize_key(artist, title)
+    return (key, title, artist, shazam_url or None, links), (user_id, bool(is_original), key)
+
+def _save_track_rows(conn, tracks: Sequence[TrackRow]):
+    """Дополняет каталог и связывает с ним пользователей; повторная находка не дублируется"""
+    catalog_rows, link_rows = zip(*(_catalog_row(*row) for row in tracks))
+    conn.executemany(
+        """INSERT INTO catalog (norm_key, title, artist, shazam_url, platform_links)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (norm_key) DO UPDATE SET
+            shazam_url = COALESCE(excluded.shazam_url, shazam_url),
+            platform_links = COALESCE(excluded.platform_links, platform_links),
+            updated_at = CURRENT_TIMESTAMP""",
+        catalog_rows
+    )
+    conn.executemany(
+        """INSERT INTO tracks (catalog_id, found_by, is_original)
+        SELECT id, ?, ? FROM catalog WHERE norm_key = ?
+        ON CONFLICT (found_by, catalog_id) DO NOTHING""",
+        link_rows
+    )
+
+def save_track(user_id: int, title: str, artist: str, is_original: bool,
+               shazam_url: Optional[str] = None,
+               platform_links: Optional[Sequence[Dict[str, str]]] = None):
+    """Сохраняет найденный трек в каталог и историю пользователя"""
     try:
-        conn.execute(
-            """INSERT INTO tracks 
-            (title, artist, is_original, found_by) 
-            VALUES (?, ?, ?, ?)""",
-            (title, artist, is_original, user_id)
-        )
-        conn.commit()
+        with db_connection() as conn:
+            _save_track_rows(conn, [(user_id, title, artist, is_original, shazam_url, platform_links)])
         return True
     except Error as e:
         print(f"Ошибка сохранения трека: {e}")
         return False
-    finally:
-        conn.close()
+
+def save_tracks(tracks: List[TrackRow]):
+    """Сохраняет пачку треков (user_id, title, artist, is_original, ...) одной транзакцией"""
+    if not tracks:
+        return True
+    try:
+        with db_connection() as conn:
+            _save_track_rows(conn, tracks)
+        return True
+    except Error as e:
+        print(f"Ошибка сохранения треков: {e}")
+        return False
 
 def get_user_tracks(user_id: int):
-    """Получает все треки, найденные пользователем"""
-    conn = get_db_connection()
+    """Получает все треки, найденные пользователем, и сколько пользователей их нашли"""
     try:
-        tracks = conn.execute(
-            """SELECT id, title, artist, is_original, found_at 
-            FROM tracks WHERE found_by = ? 
-            ORDER BY found_at DESC""",
-            (user_id,)
-        ).fetchall()
-        return tracks
+        with db_connection() as conn:
+            return conn.execute(
+                """SELECT t.id, c.title, c.artist, t.is_original, t.found_at, c.found_count
+                FROM tracks t
+                JOIN catalog c ON c.id = t.catalog_id
+                WHERE t.found_by = ?
+                ORDER BY t.found_at DESC""",
+                (user_id,)
+            ).fetchall()
     except Error as e:
         print(f"Ошибка получения треков: {e}")
         return []
-    finally:
-        conn.close()
+
+def get_users_after(after_id: int, limit: int):
+    """Получает пачку пользователей с id > after_id без учётных данных.
+
+    username не отдаётся: он имеет вид user_<логин>, а вход проверяет
+    только логин.
+    """
+    with db_connection() as conn:
+        return conn.execute(
+            """SELECT id, is_admin, created_at
+            FROM users WHERE id > ?
+            ORDER BY id LIMIT ?""",
+            (after_id, limit)
+        ).fetchall()
 
 def get_user_by_login(login: str):
     """Получает пользователя по логину"""
-    conn = get_db_connection()
-    user = conn.execute(
-        "SELECT * FROM users WHERE login = ?",
-        (login,)
-    ).fetchone()
-    conn.close()
-    return user
-
-def create_discussion(user_id: int, track_id: int, title: str):
-    """Создает новое обсуждение"""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute(
-            """INSERT INTO discussions 
-            (track_id, created_by, title) 
-            VALUES (?, ?, ?)""",
-            (track_id, user_id, title)
-        )
-        discussion_id = cursor.lastrowid
-        conn.commit()
-        return discussion_id
-    except Error as e:
-        print(f"Ошибка создания обсуждения: {e}")
-        return None
-    finally:
-        conn.close()
+    with db_connection() as conn:
+        return conn.execute(
+            "SELECT * FROM users WHERE login = ?",
+            (login,)
+        ).fetchone()
 
-def get_all_discussions():
-    """Получает все обсуждения с информацией о треке и авторе"""
-    conn = get_db_connection()
+def get_all_discussions(cursor: Optional[str] = None, direction: str = "next", limit: int = PAGE_SIZE):
+    """Получает страницу обсуждений с информацией о треке и авторе"""
     try:
-        return conn.execute(
-            """SELECT d.id, d.title, d.created_at, 
-                  t.title as track_title, t.artist as track_artist,
-                  u.username as author
-            FROM discussions d
-            JOIN tracks t ON d.track_id = t.id
-            JOIN users u ON d.created_by = u.id
-            ORDER BY d.created_at DESC"""
-        ).fetchall()
+        with db_connection() as conn:
+            return fetch_page(
+                conn,
+                """SELECT d.id, d.title, d.created_at, 
+                      c.title as track_title, c.artist as track_artist,
+                      u.username as author,
+                      COALESCE(a.comment_count, 0) as comment_count,
+                      a.last_comment_at
+                FROM discussions d
+                JOIN tracks t ON d.track_id = t.id
+                JOIN catalog c ON c.id = t.catalog_id
+                JOIN users u ON d.created_by = u.id
+                LEFT JOIN discussion_activity a ON a.discussion_id = d.id
+                WHERE {where}
+                ORDER BY {order}""",
+                (),
+                ("d.created_at", "d.id"),
+                cursor, direction, limit
+            )
     except Error as e:
         print(f"Ошибка получения обсуждений: {e}")
-        return []
-    finally:
-        conn.close()
+        return Page([], None, None)
 
 def get_discussion_stats():
-    """Получает статистику форума"""
-    conn = get_db_connection()
+    """Получает статистику форума из поддерживаемых триггерами счётчиков"""
     try:
-        total_discussions = conn.execute(
-            "SELECT COUNT(*) FROM discussions"
-        ).fetchone()[0]
-        
-        total_comments = conn.execute(
-            "SELECT COUNT(*) FROM comments"
-        ).fetchone()[0]
+        with db_connection() as conn:
+            counters = dict(conn.execute(
+                "SELECT name, value FROM forum_counters"
+            ).fetchall())
         
         return {
-            "total_discussions": total_discussions,
-            "total_comments": total_comments
+            "total_discussions": counters.get("discussions", 0),
+            "total_comments": counters.get("comments", 0)
         }
     except Error as e:
         print(f"Ошибка получения статистики: {e}")
         return {"total_discussions": 0, "total_comments": 0}
-    finally:
-        conn.close()
 
 def create_discussion(track_id: int, created_by: int, title: str):
     """Создает новое обсуждение и возвращает его ID"""
-    conn = get_db_connection()
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            """INSERT INTO discussions 
-            (track_id, created_by, title) 
-            VALUES (?, ?, ?)""",
-            (track_id, created_by, title)
-        )
-        discussion_id = cursor.lastrowid
-        conn.commit()
-        return discussion_id
+        with db_connection() as conn:
+            cursor = conn.execute(
+                """INSERT INTO discussions 
+                (track_id, created_by, title) 
+                VALUES (?, ?, ?)""",
+                (track_id, created_by, title)
+            )
+            return cursor.lastrowid
     except Error as e:
         print(f"Ошибка создания обсуждения: {e}")
         return None
-    finally:
-        conn.close()
 
 def get_discussion(discussion_id: int):
     """Получает обсуждение с информацией о треке и авторе"""
-    conn = get_db_connection()
     try:
-        return conn.execute(
-            """SELECT d.id, d.title, d.created_at,
-                  t.title as track_title, t.artist as track_artist,
-                  u.username as author
-            FROM discussions d
-            JOIN tracks t ON d.track_id = t.id
-            JOIN users u ON d.created_by = u.id
-            WHERE d.id = ?""",
-            (discussion_id,)
-        ).fetchone()
+        with db_connection() as conn:
+            return conn.execute(
+                """SELECT d.id, d.title, d.created_at,
+                      c.title as track_title, c.artist as track_artist,
+                      u.username as author,
+                      COALESCE(a.comment_count, 0) as comment_count,
+                      a.last_comment_at
+                FROM discussions d
+                JOIN tracks t ON d.track_id = t.id
+                JOIN catalog c ON c.id = t.catalog_id
+                JOIN users u ON d.created_by = u.id
+                LEFT JOIN discussion_activity a ON a.discussion_id = d.id
+                WHERE d.id = ?""",
+                (discussion_id,)
+            ).fetchone()
     except Error as e:
         print(f"Ошибка получения обсуждения: {e}")
         return None
-    finally:
-        conn.close()
 
-def get_comments(discussion_id: int):
-    """Получает все комментарии к обсуждению"""
-    conn = get_db_connection()
+def get_comments(discussion_id: int, cursor: Optional[str] = None, direction: str = "next",
+                 limit: int = PAGE_SIZE):
+    """Получает страницу комментариев к обсуждению"""
     try:
-        return conn.execute(
-            """SELECT c.id, c.content, c.created_at,
-                  u.username as author
-            FROM comments c
-            JOIN users u ON c.user_id = u.id
-            WHERE c.discussion_id = ?
-            ORDER BY c.created_at DESC""",
-            (discussion_id,)
-        ).fetchall()
+        with db_connection() as conn:
+            return fetch_page(
+                conn,
+                """SELECT c.id, c.content, c.created_at,
+                      u.username as author
+                FROM comments c
+                JOIN users u ON c.user_id = u.id
+                WHERE c.discussion_id = ? AND {where}
+                ORDER BY {order}""",
+                (discussion_id,),
+                ("c.created_at", "c.id"),
+                cursor, direction, limit
+            )
     except Error as e:
         print(f"Ошибка получения комментариев: {e}")
-        return []
-    finally:
-        conn.close()
+        return Page([], None, None)
 
 def add_comment(discussion_id: int, user_id: int, content: str):
     """Добавляет комментарий к обсуждению"""
-    conn = get_db_connection()
     try:
-        conn.execute(
-            """INSERT INTO comments 
-            (discussion_id, user_id, content) 
-            VALUES (?, ?, ?)""",
-            (discussion_id, user_id, content)
-        )
-        conn.commit()
+        with db_connection() as conn:
+            conn.execute(
+                """INSERT INTO comments 
+                (discussion_id, user_id, content) 
+                VALUES (?, ?, ?)""",
+                (discussion_id, user_id, content)
+            )
         return True
     except Error as e:
         print(f"Ошибка добавления комментария: {e}")
         return False
-    finally:
-        conn.close()
 
 
+def insert_batch(tracks: List[TrackRow],
+                 comments: List[Tuple[int, int, str]]) -> Tuple[List[bool], List[bool]]:
+    """Вставляет пачку треков (user_id, title, artist, is_original, ...) и комментариев
+    (discussion_id, user_id, content) одной транзакцией; при ошибке — построчно"""
+    try:
+        with db_connection() as conn:
+            if tracks:
+                _save_track_rows(conn, tracks)
+            if comments:
+                conn.executemany(
+                    """INSERT INTO comments 
+                    (discussion_id, user_id, content) 
+                    VALUES (?, ?, ?)""",
+                    comments
+                )
+        return [True] * len(tracks), [True] * len(comments)
+    except Error as e:
+        print(f"Ошибка пакетной записи, повтор по одной строке: {e}")
+    return (
+        [save_track(*row) for row in tracks],
+        [add_comment(*row) for row in comments],
+    )
+
 def create_admin_account():
     """Создает административный аккаунт по умолчанию"""
-    conn = get_db_connection()
     try:
-        conn.execute(
-            "INSERT OR IGNORE INTO users (username, login, password, is_admin) VALUES (?, ?, ?, ?)",
-            ("admin", "admin1", "1", True)
-        )
-        conn.commit()
+        with db_connection() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO users (username, login, password, is_admin) VALUES (?, ?, ?, ?)",
+                ("admin", "admin1", "1", True)
+            )
     except Error as e:
         print(f"Ошибка создания админского аккаунта: {e}")
-    finally:
-        conn.close()
 
-def get_all_comments():
-    """Получает все комментарии с информацией об авторе и обсуждении"""
-    conn = get_db_connection()
+def get_all_comments(cursor: Optional[str] = None, direction: str = "next", limit: int = PAGE_SIZE):
+    """Получает страницу комментариев с информацией об авторе и обсуждении"""
     try:
-        return conn.execute(
-            """SELECT c.id, c.content, c.created_at,
-                  u.username as author,
-                  d.title as discussion_title,
-                  d.id as discussion_id
-            FROM comments c
-            JOIN users u ON c.user_id = u.id
-            JOIN discussions d ON c.discussion_id = d.id
-            ORDER BY c.created_at DESC"""
-        ).fetchall()
+        with db_connection() as conn:
+            return fetch_page(
+                conn,
+                """SELECT c.id, c.content, c.created_at,
+                      u.username as author,
+                      d.title as discussion_title,
+                      d.id as discussion_id
+                FROM comments c
+                JOIN users u ON c.user_id = u.id
+                JOIN discussions d ON c.discussion_id = d.id
+                WHERE {where}
+                ORDER BY {order}""",
+                (),
+                ("c.created_at", "c.id"),
+                cursor, direction, limit
+            )
     except Error as e:
         print(f"Ошибка получения комментариев: {e}")
-        return []
-    finally:
-        conn.close()
+        return Page([], None, None)
 
 def delete_comment(comment_id: int):
     """Удаляет комментарий из БД"""
-    conn = get_db_connection()
     try:
-        conn.execute("DELETE FROM comments WHERE id = ?", (comment_id,))
-        conn.commit()
+        with db_connection() as conn:
+            conn.execute("DELETE FROM comments WHERE id = ?", (comment_id,))
         return True
     except Error as e:
         print(f"Ошибка удаления комментария: {e}")
         return False
-    finally:
-        conn.close()
 
-create_admin_account()
+def fts_query(text: str) -> Optional[str]:
+    """Превращает пользовательский ввод в запрос FTS5: все слова, с поиском по префиксу"""
+    words = _WORD_RE.findall(text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
 
-init_db()
\ No newline at end of file
+def search_local(query: str, limit: int = 20):
+    """Полнотекстовый поиск по трекам, обсуждениям и комментариям, лучшие по bm25"""
+    match = fts_query(query)
+    if match is None:
+        return []
+    markers = (SNIPPET_START, SNIPPET_END)
+    try:
+        with db_connection() as conn:
+            rows = conn.execute(
+                f"""SELECT 'track' AS kind, c.id, NULL AS discussion_id,
+                      c.title, c.artist,
+                      snippet(catalog_fts, -1, ?, ?, '…', {SNIPPET_TOKENS}) AS snippet,
+                      bm25(catalog_fts) AS score
+                FROM catalog_fts JOIN catalog c ON c.id = catalog_fts.rowid
+                WHERE catalog_fts MATCH ?
+                ORDER BY score LIMIT ?""",
+                (*markers, match, limit)
+            ).fetchall()
+            rows += conn.execute(
+                f"""SELECT 'discussion' AS kind, d.id, d.id AS discussion_id,
+                      d.title, NULL AS artist,
+                      snippet(discussions_fts, -1, ?, ?, '…', {SNIPPET_TOKENS}) AS snippet,
+                      bm25(discussions_fts) AS score
+                FROM discussions_fts JOIN discussions d ON d.id = discussions_fts.rowid
+                WHERE discussions_fts MATCH ?
+                ORDER BY score LIMIT ?""",
+                (*markers, match, limit)
+            ).fetchall()
+            rows += conn.execute(
+                f"""SELECT 'comment' AS kind, c.id, c.discussion_id,
+                      d.title, NULL AS artist,
+                      snippet(comments_fts, -1, ?, ?, '…', {SNIPPET_TOKENS}) AS snippet,
+                      bm25(comments_fts) AS score
+                FROM comments_fts
+                JOIN comments c ON c.id = comments_fts.rowid
+                JOIN discussions d ON d.id = c.discussion_id
+                WHERE comments_fts MATCH ?
+                ORDER BY score LIMIT ?""",
+                (*markers, match, limit)
+            ).fetchall()
+        return sorted(rows, key=lambda row: row["score"])[:limit]
+    except Error as e:
+        print(f"Ошибка полнотекстового поиска: {e}")
+        return []
+
+def create_job(job_id: str, file_path: str, content_hash: str, username: Optional[str],
+               owner: str, lease_until: float):
+    """Регистрирует задачу распознавания в очереди процесса owner"""
+    with db_connection() as conn:
+        conn.execute(
+            """INSERT INTO recognition_jobs
+            (id, status, stage, file_path, content_hash, username, owner, lease_until)
+            VALUES (?, 'queued', 'queued', ?, ?, ?, ?, ?)""",
+            (job_id, file_path, content_hash, username, owner, lease_until)
+        )
+
+def claim_job(job_id: str, owner: str):
+    """Переводит задачу из очереди в работу; False, если её взял другой процесс"""
+    with db_connection() as conn:
+        cursor = conn.execute(
+            """UPDATE recognition_jobs
+            SET status = 'running', stage = 'running', updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'queued' AND owner = ?""",
+            (job_id, owner)
+        )
+        return cursor.rowcount == 1
+
+def renew_job_leases(owner: str, lease_until: float):
+    """Продлевает аренду незавершённых задач процесса owner"""
+    with db_connection() as conn:
+        return conn.execute(
+            """UPDATE recognition_jobs SET lease_until = ?
+            WHERE owner = ? AND status IN ('queued', 'running')""",
+            (lease_until, owner)
+        ).rowcount
+
+def release_job_leases(owner: str, job_id: Optional[str] = None):
+    """Снимает аренду задач процесса owner (или одной задачи), чтобы их сразу забрал другой"""
+    with db_connection() as conn:
+        conn.execute(
+            """UPDATE recognition_jobs SET lease_until = 0
+            WHERE owner = ? AND status IN ('queued', 'running')
+              AND (? IS NULL OR id = ?)""",
+            (owner, job_id, job_id)
+        )
+
+def take_over_stale_jobs(owner: str, lease_until: float, now: float, limit: int):
+    """Забирает в очередь owner незавершённые задачи с истёкшей арендой.
+
+    Каждая задача перехватывается отдельным условным UPDATE, поэтому при
+    одновременном восстановлении в нескольких процессах она достаётся одному.
+    """
+    with db_connection() as conn:
+        candidates = conn.execute(
+            """SELECT id, file_path, content_hash, username
+            FROM recognition_jobs
+            WHERE status IN ('queued', 'running')
+              AND (lease_until IS NULL OR lease_until < ?)
+            ORDER BY created_at LIMIT ?""",
+            (now, limit)
+        ).fetchall()
+        taken = []
+        for job in candidates:
+            cursor = conn.execute(
+                """UPDATE recognition_jobs
+                SET owner = ?, lease_until = ?, status = 'queued', stage = 'queued',
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status IN ('queued', 'running')
+                  AND (lease_until IS NULL OR lease_until < ?)""",
+                (owner, lease_until, job["id"], now)
+            )
+            if cursor.rowcount == 1:
+                taken.append(job)
+        return taken
+
+def prune_jobs(retention_seconds: float):
+    """Удаляет завершённые задачи старше retention_seconds; возвращает их число"""
+    with db_connection() as conn:
+        return conn.execute(
+            """DELETE FROM recognition_jobs
+            WHERE status IN ('done', 'failed') AND updated_at < datetime('now', ?)""",
+            (f"-{int(retention_seconds)} seconds",)
+        ).rowcount
+
+def update_job(job_id: str, status: str, stage: str,
+               result: Optional[str] = None, error: Optional[str] = None):
+    """Обновляет состояние задачи распознавания"""
+    try:
+        with db_connection() as conn:
+            conn.execute(
+                """UPDATE recognition_jobs
+                SET status = ?, stage = ?,
+                    result = COALESCE(?, result), error = COALESCE(?, error),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?""",
+                (status, stage, result, error, job_id)
+            )
+        return True
+    except Error as e:
+        print(f"Ошибка обновления задачи: {e}")
+        return False
+
+def get_job(job_id: str):
+    """Получает задачу распознавания по ID"""
+    with db_connection() as conn:
+        return conn.execute(
+            """SELECT id, status, stage, file_path, content_hash, username,
+                  result, error, created_at, updated_at
+            FROM recognition_jobs WHERE id = ?""",
+            (job_id,)
+        ).fetchone()
+
+init_db()
+
+create_admin_account()
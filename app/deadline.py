@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, Optional, Union
+
+from .metrics import counter
+
+# Бюджет времени запроса по эндпоинтам, сек; переопределяется переменной
+# окружения SOUNDHOME_DEADLINE_<ИМЯ>. Для распознавания бюджет отсчитывается
+# с приёма файла, поэтому ожидание в очереди задач тоже из него вычитается.
+ENDPOINT_DEADLINES = {
+    "recognize": 60.0,
+    "recognize_batch": 300.0,
+    "search": 15.0,
+}
+
+# Момент (time.monotonic), к которому запрос должен быть выполнен, или
+# SharedDeadline общей работы нескольких запросов. asyncio копирует контекст
+# в задачи и в asyncio.to_thread, а loop.run_in_executor и
+# ThreadPoolExecutor.submit — нет: им передаётся copy_context().run.
+_deadline: contextvars.ContextVar[Union[float, "SharedDeadline", None]] = contextvars.ContextVar(
+    "deadline", default=None
+)
+
+deadlines_exceeded = counter(
+    "soundhome_deadline_exceeded_total",
+    "Этапы, пропущенные или прерванные из-за исчерпанного бюджета запроса",
+    ["stage"],
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Бюджет времени запроса исчерпан"""
+
+
+class SharedDeadline:
+    """Дедлайн работы, которую ждут несколько запросов: самый поздний из их дедлайнов"""
+
+    def __init__(self, at: Optional[float]):
+        self.at = at
+
+    def extend(self, at: Optional[float]) -> None:
+        """Учитывает дедлайн ещё одного ожидающего; None — без ограничения"""
+        if self.at is not None:
+            self.at = None if at is None else max(self.at, at)
+
+
+def current() -> Optional[float]:
+    """Действующий дедлайн; None — не установлен"""
+    at = _deadline.get()
+    return at.at if isinstance(at, SharedDeadline) else at
+
+
+def endpoint_budget(name: str) -> float:
+    return float(os.getenv(f"SOUNDHOME_DEADLINE_{name.upper()}", ENDPOINT_DEADLINES[name]))
+
+
+def deadline_in(seconds: float) -> float:
+    """Абсолютный дедлайн через seconds секунд, не позже уже действующего"""
+    at = time.monotonic() + seconds
+    now_at = current()
+    return at if now_at is None else min(at, now_at)
+
+
+@contextmanager
+def until(at: Union[float, SharedDeadline, None]) -> Iterator[None]:
+    """Устанавливает дедлайн для кода внутри блока; None — без ограничения"""
+    token = _deadline.set(at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def budget(name: str):
+    """Дедлайн по бюджету эндпоинта, отсчитанный от текущего момента"""
+    return until(deadline_in(endpoint_budget(name)))
+
+
+def remaining() -> Optional[float]:
+    """Сколько секунд осталось; None — дедлайн не установлен"""
+    at = current()
+    return None if at is None else at - time.monotonic()
+
+
+def exceeded(stage: str) -> DeadlineExceeded:
+    """Учитывает пропущенный этап и возвращает исключение для него"""
+    deadlines_exceeded.inc(stage=stage)
+    left = max(remaining() or 0.0, 0.0)
+    return DeadlineExceeded(f"{stage}: осталось {left:.2f} сек из бюджета запроса")
+
+
+def check(stage: str, need: float = 0.0) -> None:
+    """Поднимает DeadlineExceeded, если на этап осталось меньше need секунд"""
+    left = remaining()
+    if left is not None and left < need:
+        raise exceeded(stage)
+
+
+def timeout(default: Optional[float] = None) -> Optional[float]:
+    """Таймаут операции: default, урезанный до остатка бюджета"""
+    left = remaining()
+    if left is None:
+        return default
+    left = max(left, 0.0)
+    return left if default is None else min(default, left)
+
+
+async def wait_for(awaitable: Awaitable[Any], stage: str) -> Any:
+    """Ждёт awaitable не дольше остатка бюджета"""
+    left = remaining()
+    if left is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, max(left, 0.0))
+    except asyncio.TimeoutError:
+        if remaining() > 0:
+            # Таймаут самой операции, а не бюджета запроса
+            raise
+        raise exceeded(stage) from None
+
+
+def run_in_executor(executor, func: Callable[..., Any], *args) -> "asyncio.Future[Any]":
+    """loop.run_in_executor, при котором дедлайн виден в потоке пула"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(executor, contextvars.copy_context().run, func, *args)
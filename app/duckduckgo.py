@@ -1,41 +1,83 @@
-from duckduckgo_search import DDGS
+from duckduckgo_search.exceptions import RatelimitException
 from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+import os
 import re
 import time
 import random
 import logging
 from functools import wraps
-from random import uniform
+
+from . import deadline
+from .breaker import CircuitOpen
+from .cache import MISSING, search_cache
+from .metrics import errors, retries, stage_seconds
+from .normalize import normalize_key
+from .platforms import classify_url, source_suffix_re
+from .providers import search_backend
+from .singleflight import search_flight
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-MUSIC_PLATFORMS = {
-    "YouTube": r"youtube\.com|youtu\.be",
-    "Spotify": r"spotify\.com",
-    "Apple Music": r"music\.apple\.com",
-    "Deezer": r"deezer\.com",
-    "Yandex Music": r"music\.yandex\.(ru|com)",
-    "SoundCloud": r"soundcloud\.com",
-    "VK Music": r"vk\.com/music",
-    "Bandcamp": r"bandcamp\.com",
-    "Tidal": r"tidal\.com",
-    "Amazon Music": r"amazon\.com/music"
-}
-
-def retry(max_retries=3, delay_range=(1.0, 3.0)):
-    """Декоратор для повторных попыток с экспоненциальной задержкой"""
+# Поиск синхронный и спит между попытками, поэтому выполняется в отдельном
+# пуле потоков, чтобы не блокировать цикл событий uvicorn.
+SEARCH_MAX_WORKERS = int(os.getenv("SOUNDHOME_SEARCH_WORKERS", "4"))
+SEARCH_MAX_QUEUE = int(os.getenv("SOUNDHOME_SEARCH_QUEUE", "32"))
+
+_search_executor = ThreadPoolExecutor(
+    max_workers=SEARCH_MAX_WORKERS,
+    thread_name_prefix="ddg-search"
+)
+_search_pending = 0
+
+_search_seconds = stage_seconds.labels(stage="search_track")
+_providers_seconds = stage_seconds.labels(stage="search_providers")
+_filter_seconds = stage_seconds.labels(stage="search_filter")
+_retry_delay_seconds = stage_seconds.labels(stage="retry_delay")
+_search_errors = errors.labels(stage="search")
+
+# Повтор не начинается, если до дедлайна запроса осталось меньше паузы
+# плюс RETRY_MIN_ATTEMPT_SECONDS на саму попытку
+RETRY_MIN_ATTEMPT_SECONDS = 1.0
+
+
+class SearchQueueFull(Exception):
+    """Очередь поиска переполнена, запрос отклонён без ожидания"""
+
+def retry(max_retries=3, delay_range=(1.0, 3.0), no_delay_on=(), give_up_on=()):
+    """Декоратор для повторных попыток с экспоненциальной задержкой.
+
+    После исключений из no_delay_on повтор идёт без паузы: ожидание в этом
+    случае обеспечивает лимитер запросов. Исключения из give_up_on
+    пробрасываются сразу, без повторов. Повтор, который не успеет
+    завершиться до дедлайна запроса, не начинается.
+    """
     def decorator(func):
+        retried = retries.labels(function=func.__name__)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             last_exception = None
             for attempt in range(max_retries):
-                try:
-                    if attempt > 0:
+                if attempt > 0:
+                    delay = 0.0
+                    if not isinstance(last_exception, no_delay_on):
                         delay = random.uniform(*delay_range) * (attempt + 1)
+                    left = deadline.remaining()
+                    if left is not None and left < delay + RETRY_MIN_ATTEMPT_SECONDS:
+                        deadline.deadlines_exceeded.inc(stage="retry")
+                        logger.info(f"Retry #{attempt + 1} skipped: {max(left, 0.0):.2f} seconds left")
+                        break
+                    retried.inc()
+                    if delay:
                         logger.info(f"Retry #{attempt + 1} after {delay:.2f} seconds...")
                         time.sleep(delay)
+                        _retry_delay_seconds.observe(delay)
+                try:
                     return func(*args, **kwargs)
+                except give_up_on:
+                    raise
                 except Exception as e:
                     last_exception = e
                     logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
@@ -43,17 +85,16 @@ def retry(max_retries=3, delay_range=(1.0, 3.0)):
         return wrapper
     return decorator
 
-def is_music_url(url: str) -> bool:
-    """Проверяет, является ли URL музыкальной платформой"""
-    return any(re.search(pattern, url) for pattern in MUSIC_PLATFORMS.values())
+_TITLE_NOISE_RE = re.compile(r'(official|lyrics?|video|audio|mp3|download|free|HD|HQ)', re.IGNORECASE)
 
 def clean_title(title: str, source: str) -> str:
     """Очищает заголовок от мусора"""
-    title = re.sub(rf'\s*-\s*{source}.*$', '', title, flags=re.IGNORECASE)
-    title = re.sub(r'(official|lyrics?|video|audio|mp3|download|free|HD|HQ)', '', title, flags=re.IGNORECASE)
+    title = source_suffix_re(source).sub('', title)
+    title = _TITLE_NOISE_RE.sub('', title)
     return title.strip()
 
-@retry(max_retries=3, delay_range=(2.0, 6.0))
+@retry(max_retries=3, delay_range=(0.5, 1.5), no_delay_on=(RatelimitException,),
+       give_up_on=(CircuitOpen, deadline.DeadlineExceeded))
 def search_track(title: str, artist: str) -> Optional[List[Dict[str, str]]]:
     """Ищет трек с логированием времени и попыток"""
     query = f"{artist} - {title} (music OR official)"
@@ -63,51 +104,73 @@ def search_track(title: str, artist: str) -> Optional[List[Dict[str, str]]]:
     logger.info(f"▶️ Начало поиска: {query}")
     
     try:
-        with DDGS() as ddgs:
-            
-            delay = random.uniform(2.0, 6.0)
-            logger.info(f"⏳ Задержка перед запросом: {delay:.2f} сек")
-            time.sleep(delay)
-            
-            
-            search_start = time.time()
-            raw_results = list(ddgs.text(query, max_results=20))
-            search_duration = time.time() - search_start
-            logger.info(f"🔍 Получено {len(raw_results)} результатов за {search_duration:.2f} сек")
-            
-            
-            filtered_results = []
-            seen_urls = set()
-            
-            for item in raw_results:
-                url = item["href"]
-                if url in seen_urls or not is_music_url(url):
-                    continue
-                
-                source = next((name for name, pattern in MUSIC_PLATFORMS.items() 
-                             if re.search(pattern, url)), "Other Music")
-                
-                filtered_results.append({
-                    "title": clean_title(item["title"], source),
-                    "url": normalize_music_url(url, source),
-                    "source": source
-                })
-                
-                if len(filtered_results) >= 5:
-                    break
+        search_start = time.time()
+        raw_results = search_backend.search(query, max_results=20)
+        search_duration = time.time() - search_start
+        _providers_seconds.observe(search_duration)
+        logger.info(f"🔍 Получено {len(raw_results)} результатов за {search_duration:.2f} сек")
+
+        filter_start = time.perf_counter()
+        filtered_results = []
+        seen_urls = set()
+        
+        for item in raw_results:
+            match = classify_url(item["href"])
+            if match is None or match.url in seen_urls:
+                continue
+            seen_urls.add(match.url)
             
-            total_time = time.time() - start_time
-            logger.info(f"✅ Успешно. Найдено треков: {len(filtered_results)}. Общее время: {total_time:.2f} сек")
-            return filtered_results if filtered_results else None
+            filtered_results.append({
+                "title": clean_title(item["title"], match.platform),
+                "url": match.url,
+                "source": match.platform
+            })
             
+            if len(filtered_results) >= 5:
+                break
+        
+        _filter_seconds.observe(time.perf_counter() - filter_start)
+        total_time = time.time() - start_time
+        logger.info(f"✅ Успешно. Найдено треков: {len(filtered_results)}. Общее время: {total_time:.2f} сек")
+        return filtered_results if filtered_results else None
+        
+    except (CircuitOpen, deadline.DeadlineExceeded):
+        raise
     except Exception as e:
+        _search_errors.inc()
         logger.error(f"❌ Ошибка поиска: {str(e)}")
         raise
 
-def normalize_music_url(url: str, source: str) -> str:
-    """Нормализует URL для музыкальных платформ"""
-    if source == "VK Music":
-        return re.sub(r'(vk\.com/)(audio|music/album)(-?\d+_\d+)', r'\1music/album/\3', url)
-    elif source == "Yandex Music":
-        return re.sub(r'(track/)\d+', r'\1', url)
-    return url
+async def search_track_async(title: str, artist: str) -> Optional[List[Dict[str, str]]]:
+    """Асинхронная обёртка над search_track с кэшем и ограниченной очередью"""
+    key = normalize_key(artist, title)
+    cached = await search_cache.aget(key)
+    if cached is not MISSING:
+        logger.info(f"💾 Результат поиска из кэша: {key}")
+        return cached
+
+    # Разомкнутые предохранители и исчерпанный бюджет отвечают сразу,
+    # не занимая очередь поиска
+    search_backend.check_available()
+    deadline.check("search_queue", need=RETRY_MIN_ATTEMPT_SECONDS)
+    return await search_flight.do(key, lambda: _search_and_cache(title, artist, key))
+
+
+async def _search_and_cache(title: str, artist: str, key: str) -> Optional[List[Dict[str, str]]]:
+    global _search_pending
+    if _search_pending >= SEARCH_MAX_WORKERS + SEARCH_MAX_QUEUE:
+        logger.warning(f"Очередь поиска переполнена ({_search_pending} запросов)")
+        raise SearchQueueFull("Слишком много одновременных запросов поиска")
+
+    _search_pending += 1
+    try:
+        with _search_seconds.time():
+            results = await deadline.wait_for(
+                deadline.run_in_executor(_search_executor, search_track, title, artist),
+                "search"
+            )
+    finally:
+        _search_pending -= 1
+
+    await search_cache.aset(key, results)
+    return results
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+from . import deadline
+from .async_database import (
+    claim_job, create_job, get_job, prune_jobs, release_job_leases, renew_job_leases,
+    take_over_stale_jobs, update_job,
+)
+from .metrics import errors
+from .pipeline import run_recognition
+from .uploads import SavedUpload, remove_upload
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = 4
+JOB_QUEUE_SIZE = 100
+# Как часто подписчик SSE перечитывает задачу из БД: события публикуются
+# только внутри процесса, а задачу может выполнять другой воркер uvicorn.
+JOB_EVENTS_POLL_SECONDS = 2.0
+# Незавершённые задачи принадлежат процессу, который их поставил или забрал,
+# пока он продлевает аренду. Задачи с истёкшей арендой (процесс завершился)
+# забирает любой живой воркер; завершённые удаляются через JOB_RETENTION_SECONDS.
+JOB_LEASE_SECONDS = 60.0
+JOB_HEARTBEAT_SECONDS = 15.0
+JOB_RETENTION_SECONDS = int(os.getenv("SOUNDHOME_JOB_RETENTION_HOURS", "24")) * 3600
+
+TERMINAL_STATUSES = {"done", "failed"}
+
+
+class JobQueueFull(Exception):
+    """Очередь задач распознавания переполнена"""
+
+
+def job_to_dict(job) -> Dict[str, Any]:
+    """Представление задачи для клиента, без пути к файлу и логина"""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "result": json.loads(job["result"]) if job["result"] else None,
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+class JobManager:
+    """Ограниченная очередь задач распознавания с пулом asyncio-воркеров"""
+
+    def __init__(self, workers: int = JOB_WORKERS, queue_size: int = JOB_QUEUE_SIZE):
+        self.workers = workers
+        self._queue: "asyncio.Queue[tuple]" = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    async def start(self) -> None:
+        """Запускает воркеры и забирает задачи процессов, которые перестали продлевать аренду"""
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        await self._recover()
+        await prune_jobs(JOB_RETENTION_SECONDS)
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self) -> None:
+        """Останавливает воркеры и снимает аренду: незавершённые задачи сразу заберёт следующий запуск"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await release_job_leases(self.owner)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                await renew_job_leases(self.owner, time.time() + JOB_LEASE_SECONDS)
+                await self._recover()
+                await prune_jobs(JOB_RETENTION_SECONDS)
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания очереди задач: {e}")
+
+    async def _recover(self) -> None:
+        """Ставит в свою очередь задачи с истёкшей арендой.
+
+        Забирается не больше задач, чем свободных мест в очереди; каждая
+        получает новый бюджет времени с момента восстановления.
+        """
+        free = self._queue.maxsize - self._queue.qsize()
+        if free <= 0:
+            return
+        now = time.time()
+        for job in await take_over_stale_jobs(self.owner, now + JOB_LEASE_SECONDS, now, free):
+            if not (job["file_path"] and os.path.exists(job["file_path"])):
+                await update_job(job["id"], "failed", "failed", error="Файл загрузки потерян при перезапуске")
+                continue
+            deadline_at = deadline.deadline_in(deadline.endpoint_budget("recognize"))
+            try:
+                self._queue.put_nowait((job["id"], job["file_path"], job["content_hash"], job["username"],
+                                        deadline_at))
+            except asyncio.QueueFull:
+                # Место заняли новые загрузки: задачу заберёт следующий обход
+                await release_job_leases(self.owner, job["id"])
+
+    async def submit(self, upload: SavedUpload, username: Optional[str],
+                     deadline_at: Optional[float] = None) -> str:
+        """Ставит загрузку в очередь и возвращает ID задачи; deadline_at — дедлайн запроса"""
+        if self._queue.full():
+            raise JobQueueFull("Очередь распознавания переполнена")
+        job_id = uuid.uuid4().hex
+        await create_job(job_id, upload.path, upload.content_hash, username,
+                         self.owner, time.time() + JOB_LEASE_SECONDS)
+        try:
+            self._queue.put_nowait((job_id, upload.path, upload.content_hash, username, deadline_at))
+        except asyncio.QueueFull:
+            await update_job(job_id, "failed", "failed", error="Очередь распознавания переполнена")
+            raise JobQueueFull("Очередь распознавания переполнена")
+        return job_id
+
+    async def events(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """Текущее состояние задачи и её последующие изменения до завершения"""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        try:
+            job = await get_job(job_id)
+            if job is None:
+                return
+            last = job_to_dict(job)
+            yield last
+            while last["status"] not in TERMINAL_STATUSES:
+                try:
+                    event = await asyncio.wait_for(queue.get(), JOB_EVENTS_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    event = job_to_dict(await get_job(job_id))
+                if (event["status"], event["stage"]) != (last["status"], last["stage"]):
+                    yield event
+                last = event
+        finally:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[job_id]
+
+    def _publish(self, job_id: str, event: Dict[str, Any]) -> None:
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait(event)
+
+    async def _set_state(self, job_id: str, status: str, stage: str,
+                         result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+        await update_job(
+            job_id, status, stage,
+            result=json.dumps(result, ensure_ascii=False) if result is not None else None,
+            error=error
+        )
+        job = await get_job(job_id)
+        if job is not None:
+            self._publish(job_id, job_to_dict(job))
+
+    async def _worker(self) -> None:
+        while True:
+            job_id, file_path, content_hash, username, deadline_at = await self._queue.get()
+            try:
+                await self._run(job_id, file_path, content_hash, username, deadline_at)
+            except Exception as e:
+                logger.error(f"Ошибка воркера задач: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str, file_path: str, content_hash: str, username: Optional[str],
+                   deadline_at: Optional[float] = None) -> None:
+        if not await claim_job(job_id, self.owner):
+            return
+
+        async def on_stage(stage: str) -> None:
+            # Прогресс задачи записывается всегда, вне бюджета запроса
+            with deadline.until(None):
+                await self._set_state(job_id, "running", stage)
+
+        try:
+            with deadline.until(deadline_at):
+                result = await run_recognition(file_path, content_hash, username, on_stage)
+        except Exception as e:
+            errors.inc(stage="job")
+            logger.error(f"Error processing job {job_id}: {e}")
+            await self._set_state(job_id, "failed", "failed", error="Ошибка обработки файла")
+        else:
+            await self._set_state(job_id, "done", "done", result=result)
+        remove_upload(file_path)
@@ -1,39 +1,48 @@
 from fastapi import FastAPI, UploadFile, HTTPException, Request, Form, Depends
-from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from typing import Optional
-import os
 import asyncio
+import html
+import json
 import logging
 from pathlib import Path
-from .shazam import recognize_song
-from .duckduckgo import search_track
+from . import deadline, metrics
+from .breaker import CircuitOpen, breaker_stats
+from .jobs import JobManager, JobQueueFull, job_to_dict
+from .pipeline import run_batch
+from .providers import search_backend
+from .search import search_by_query
+from .singleflight import recognition_flight, search_flight
+from .uploads import MAX_BATCH_BYTES, MAX_UPLOAD_BYTES, SavedUpload, UploadRejected, UploadSizeLimit, remove_upload, save_batch, save_upload
+from .users import SessionUser, current_user, is_admin_user, remember_user, require_admin, require_user, user_cache
+from .writebehind import write_behind
 from typing import List, Optional
 from pydantic import BaseModel
 from fastapi import FastAPI, HTTPException
-from .database import get_db_connection, create_user_simple, check_user_simple, get_user_by_login, save_track, get_user_tracks, get_all_discussions, get_discussion_stats, get_discussion, get_comments, add_comment, create_discussion, get_all_comments, delete_comment
 from starlette.middleware.sessions import SessionMiddleware
 from pydantic import BaseModel
 import logging
 
-from .database import (
-    get_db_connection,
+from . import async_database
+from .async_database import (
     create_user_simple,  
     check_user_simple,    
-    get_user_by_login,
-    save_track,
     get_user_tracks,
     get_discussion_stats,
     get_all_discussions,
+    get_users_after,
+    get_job,
     get_comments,
     get_discussion,
-    add_comment,
     create_discussion,
     get_all_comments,
-    delete_comment
+    delete_comment,
+    search_local
 )
+from .database import SNIPPET_END, SNIPPET_START
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -42,10 +51,6 @@ logger = logging.getLogger(__name__)
 Path("static").mkdir(exist_ok=True)
 Path("templates").mkdir(exist_ok=True)
 
-def is_admin(user: dict) -> bool:
-    """Проверяет, является ли пользователь администратором"""
-    return user.get("is_admin", False)
-
 class SearchRequest(BaseModel):
     query: str
     genres: Optional[List[str]] = None
@@ -64,7 +69,6 @@ app = FastAPI(title="Music Analyzer")
 
 templates = Jinja2Templates(directory="templates")
 
-current_user = None
 
 app.add_middleware(
     CORSMiddleware,
@@ -88,6 +92,26 @@ def check_user(login: str, password: str) -> bool:
     logger.info(f"Попытка входа пользователя: {login}")
     return True  
 
+job_manager = JobManager()
+
+@app.on_event("startup")
+async def start_job_workers():
+    await write_behind.start()
+    await job_manager.start()
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    await job_manager.stop()
+    await write_behind.stop()
+    async_database.shutdown()
+
+# Размер загрузки ограничивается до разбора multipart: и по Content-Length,
+# и по фактически прочитанным байтам для chunked-запросов
+app.add_middleware(
+    UploadSizeLimit,
+    limits={"/api/recognize": MAX_UPLOAD_BYTES, "/api/recognize/batch": MAX_BATCH_BYTES},
+)
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
@@ -102,73 +126,146 @@ async def home(request: Request):
     })
 
 
-@app.post("/api/recognize")
+@app.post("/api/recognize", status_code=202)
 async def analyze_music(file: UploadFile, request: Request):
     logger.info("File received: %s", file.filename)
-    
-    temp_file = f"temp_{file.filename}"
-    try:
-        with open(temp_file, "wb") as buffer:
-            buffer.write(await file.read())
-        
-        shazam_data = await recognize_song(temp_file)
-        if not shazam_data:
-            return JSONResponse({
-                "status": "original",
-                "message": "Трек оригинален",
-                "originality_score": 100
-            })
-
-     
-        try:
-            search_results = search_track(title=shazam_data["title"], artist=shazam_data["artist"])
-            
-            if search_results is None:  
-                originality = "unknown"
-                message = "Не удалось проверить на платформах"
-                originality_score = 50
-            else:
-                originality = "common" if len(search_results) >= 2 else "original"
-                message = ("Трек найден на популярных платформах" if originality == "common" 
-                          else "Трек оригинален (не найден на музыкальных платформах)")
-                originality_score = 0 if originality == "common" else 80
-            
-          
-            username = request.session.get("username")
-            if username and originality == "common":
-                user = get_user_by_login(username)
-                if user:
-                    save_track(
-                        user_id=user["id"],
-                        title=shazam_data["title"],
-                        artist=shazam_data["artist"],
-                        is_original=False
-                    )
-            
-            return JSONResponse({
-                "status": "success",
-                "originality": originality,
-                "message": message,
-                "metadata": shazam_data,
-                "search_results": search_results if search_results else [],
-                "originality_score": originality_score
-            })
-        except Exception as search_error:
-            logger.error(f"Search error: {search_error}")
-            return JSONResponse({
-                "status": "search_failed",
-                "message": "Ошибка при проверке на платформах",
-                "metadata": shazam_data,
-                "originality_score": 50
-            })
+    # Бюджет отсчитывается с приёма запроса: загрузка и очередь входят в него
+    deadline_at = deadline.deadline_in(deadline.endpoint_budget("recognize"))
 
+    try:
+        upload = await save_upload(file)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
+    try:
+        job_id = await job_manager.submit(upload, request.session.get("username"), deadline_at)
+    except JobQueueFull:
+        remove_upload(upload.path)
+        raise HTTPException(status_code=503, detail="Сервис перегружен, попробуйте позже")
     except Exception as e:
-        logger.error(f"Error processing file: {e}")
+        remove_upload(upload.path)
+        logger.error(f"Error queueing file: {e}")
         raise HTTPException(status_code=500, detail="Ошибка обработки файла")
-    finally:
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
+
+    return JSONResponse({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/jobs/{job_id}",
+        "events_url": f"/api/jobs/{job_id}/events"
+    }, status_code=202)
+
+@app.post("/api/recognize/batch")
+async def analyze_batch(files: List[UploadFile], request: Request):
+    """Пакетное распознавание: несколько файлов или zip-архив, ответ в NDJSON"""
+    deadline_at = deadline.deadline_in(deadline.endpoint_budget("recognize_batch"))
+    try:
+        items = await save_batch(files)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    username = request.session.get("username")
+    logger.info("Batch received: %d files", len(items))
+
+    async def stream_results():
+        try:
+            async for result in run_batch(items, username, deadline_at):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            for _, item in items:
+                if isinstance(item, SavedUpload):
+                    remove_upload(item.path)
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+SEARCH_MAX_LIMIT = 50
+
+def highlight_snippet(snippet: str) -> str:
+    """Экранирует фрагмент FTS и заменяет маркеры совпадений на <mark>"""
+    return html.escape(snippet).replace(SNIPPET_START, "<mark>").replace(SNIPPET_END, "</mark>")
+
+def local_search_result(row) -> dict:
+    return {
+        "type": row["kind"],
+        "id": row["id"],
+        "title": row["title"],
+        "artist": row["artist"],
+        "snippet": highlight_snippet(row["snippet"] or ""),
+        "score": round(row["score"], 4),
+        "url": f"/forum/{row['discussion_id']}" if row["discussion_id"] else None
+    }
+
+@app.post("/api/search")
+async def search_endpoint(search: SearchRequest):
+    """Поиск по локальному индексу; во внешний поиск — только если локально пусто"""
+    if not search.query.strip():
+        raise HTTPException(status_code=400, detail="Пустой запрос")
+    limit = max(1, min(search.limit, SEARCH_MAX_LIMIT))
+
+    rows = await search_local(search.query, limit)
+    if rows:
+        return {"source": "local", "results": [local_search_result(row) for row in rows]}
+
+    try:
+        # asyncio.to_thread копирует контекст, поэтому дедлайн виден поиску в потоке
+        with deadline.budget("search"):
+            results = await asyncio.to_thread(search_by_query, search.query, search.genres, limit)
+    except CircuitOpen:
+        raise HTTPException(status_code=503, detail="Внешний поиск временно отключён")
+    except deadline.DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Внешний поиск не уложился в отведённое время")
+    except Exception as e:
+        logger.error(f"External search error: {e}")
+        raise HTTPException(status_code=502, detail="Внешний поиск недоступен")
+    return {"source": "external", "results": results}
+
+@app.get("/api/stats")
+async def pipeline_stats():
+    """Счётчики объединения одинаковых запросов, задержки провайдеров и состояние предохранителей"""
+    return {
+        "singleflight": {
+            "recognition": recognition_flight.stats(),
+            "search": search_flight.stats()
+        },
+        "search_providers": search_backend.stats(),
+        "breakers": breaker_stats()
+    }
+
+def _singleflight_gauge(field: str):
+    return lambda: [((flight.name,), flight.stats()[field]) for flight in (recognition_flight, search_flight)]
+
+metrics.gauge_callback("soundhome_singleflight_calls", "Вызовы через single-flight",
+                       ["flight"], _singleflight_gauge("calls"))
+metrics.gauge_callback("soundhome_singleflight_coalesced", "Вызовы, объединённые с уже выполняющимися",
+                       ["flight"], _singleflight_gauge("coalesced"))
+metrics.gauge_callback("soundhome_singleflight_in_flight", "Выполняющиеся сейчас запросы",
+                       ["flight"], _singleflight_gauge("in_flight"))
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Метрики процесса в текстовом формате Prometheus"""
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    job = await get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job_to_dict(job)
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    if not await get_job(job_id):
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+
+    async def stream_events():
+        async for event in job_manager.events(job_id):
+            yield f"event: {event['stage']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/register")
 async def register(
     request: Request,
@@ -181,21 +278,34 @@ async def register(
             "error": "Логин должен быть не менее 8 символов"
         })
     
-    if create_user_simple(login, password):
-        global current_user
-        current_user = login
+    if await create_user_simple(login, password):
+        user_cache.invalidate(login)
         return RedirectResponse("/", status_code=303)
     else:
         return templates.TemplateResponse("registration.html", {
             "request": request,
             "error": "Логин уже занят"
         })
+USERS_BATCH_SIZE = 1000
+
 @app.get("/users")
-async def get_users():
-    conn = get_db_connection()
-    users = conn.execute("SELECT * FROM users").fetchall()
-    conn.close()
-    return {"users": users}
+async def get_users(after_id: int = 0, limit: Optional[int] = None):
+    """Потоковый NDJSON-список пользователей: id, is_admin, created_at"""
+    async def stream_users():
+        last_id, remaining = after_id, limit
+        while remaining is None or remaining > 0:
+            batch_size = USERS_BATCH_SIZE if remaining is None else min(USERS_BATCH_SIZE, remaining)
+            rows = await get_users_after(last_id, batch_size)
+            if not rows:
+                break
+            yield "".join(json.dumps(dict(row), ensure_ascii=False) + "\n" for row in rows)
+            last_id = rows[-1]["id"]
+            if remaining is not None:
+                remaining -= len(rows)
+            if len(rows) < batch_size:
+                break
+
+    return StreamingResponse(stream_users(), media_type="application/x-ndjson")
 
 @app.post("/login")
 async def login(
@@ -204,7 +314,11 @@ async def login(
     password: str = Form(...)
 ):
     if check_user(login, password):
+        request.session.clear()
         request.session["username"] = login
+        user = await user_cache.get(login)
+        if user:
+            remember_user(request, user)
         logger.info(f"Успешная авторизация: {login}")
         return RedirectResponse(url="/", status_code=303)  
     else:
@@ -229,47 +343,46 @@ async def auth_page(request: Request):
 
 
 @app.get("/profile", response_class=HTMLResponse)
-async def user_profile(request: Request):
-    username = request.session.get("username")
-    if not username:
+async def user_profile(request: Request, session_user: Optional[SessionUser] = Depends(current_user)):
+    if not session_user:
         return RedirectResponse(url="/auth")
     
-    user = get_user_by_login(username)
+    user = await user_cache.get(session_user.login)
     if not user:
         return RedirectResponse(url="/auth")
     
-    tracks = get_user_tracks(user["id"])
+    tracks = await get_user_tracks(session_user.id)
     
     return templates.TemplateResponse("profile.html", {
         "request": request,
-        "current_user": username,
+        "current_user": session_user.login,
         "tracks": tracks,
         "user_info": user
     })
 @app.get("/forum", response_class=HTMLResponse)
-async def forum_page(request: Request):
-    discussions = get_all_discussions()
+async def forum_page(request: Request, cursor: Optional[str] = None, direction: str = "next"):
+    page, stats = await asyncio.gather(
+        get_all_discussions(cursor, direction),
+        get_discussion_stats()
+    )
     return templates.TemplateResponse("forum.html", {
         "request": request,
         "current_user": request.session.get("username"),
-        "discussions": discussions
+        "discussions": page.items,
+        "page": page,
+        "stats": stats
     })
 
 @app.get("/forum/new", response_class=HTMLResponse)
-async def new_discussion_page(request: Request):
-    username = request.session.get("username")
-    if not username:
-        return RedirectResponse(url="/auth")
-    
-    user = get_user_by_login(username)
+async def new_discussion_page(request: Request, user: Optional[SessionUser] = Depends(current_user)):
     if not user:
         return RedirectResponse(url="/auth")
     
-    tracks = get_user_tracks(user["id"])
+    tracks = await get_user_tracks(user.id)
     
     return templates.TemplateResponse("new_discussion.html", {
         "request": request,
-        "current_user": username,
+        "current_user": user.login,
         "tracks": [t for t in tracks if not t["is_original"]]
     })
 
@@ -277,18 +390,10 @@ async def new_discussion_page(request: Request):
 async def create_discussion_endpoint(
     request: Request,
     track_id: int = Form(...),
-    title: str = Form(...)
+    title: str = Form(...),
+    user: SessionUser = Depends(require_user)
 ):
-    username = request.session.get("username")
-    if not username:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    user = get_user_by_login(username)
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-    
- 
-    discussion_id = create_discussion(track_id, user["id"], title)
+    discussion_id = await create_discussion(track_id, user.id, title)
     
     if discussion_id:
         return RedirectResponse(url=f"/forum/{discussion_id}", status_code=303)
@@ -296,37 +401,32 @@ async def create_discussion_endpoint(
         raise HTTPException(status_code=500, detail="Failed to create discussion")
     
 @app.get("/forum/{discussion_id}", response_class=HTMLResponse)
-async def view_discussion(request: Request, discussion_id: int):
-    discussion = get_discussion(discussion_id)
+async def view_discussion(request: Request, discussion_id: int,
+                          cursor: Optional[str] = None, direction: str = "next"):
+    discussion = await get_discussion(discussion_id)
     if not discussion:
         raise HTTPException(status_code=404, detail="Discussion not found")
     
-    comments = get_comments(discussion_id)
+    page = await get_comments(discussion_id, cursor, direction)
     
     return templates.TemplateResponse("discussion.html", {
         "request": request,
         "current_user": request.session.get("username"),
         "discussion": discussion,
-        "comments": comments
+        "comments": page.items,
+        "page": page
     })
 
 @app.post("/forum/{discussion_id}/comment")
 async def add_comment_to_discussion(
     request: Request,
     discussion_id: int,
-    content: str = Form(...)
+    content: str = Form(...),
+    user: SessionUser = Depends(require_user)
 ):
-    username = request.session.get("username")
-    if not username:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    user = get_user_by_login(username)
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-    
-    success = add_comment(
+    success = await write_behind.add_comment(
         discussion_id=discussion_id,
-        user_id=user["id"],
+        user_id=user.id,
         content=content
     )
     
@@ -336,37 +436,27 @@ async def add_comment_to_discussion(
         raise HTTPException(status_code=500, detail="Failed to add comment")
     
 @app.get("/admin", response_class=HTMLResponse)
-async def admin_panel(request: Request):
+async def admin_panel(request: Request, cursor: Optional[str] = None, direction: str = "next",
+                      user: Optional[SessionUser] = Depends(current_user)):
     
-    username = request.session.get("username")
-    if not username:
+    if not user:
         return RedirectResponse(url="/auth")
     
-    user = get_user_by_login(username)
-    if not user or not is_admin(user):
+    if not await is_admin_user(user):
         raise HTTPException(status_code=403, detail="Доступ запрещен")
     
     
-    comments = get_all_comments()
+    page = await get_all_comments(cursor, direction)
     
     return templates.TemplateResponse("admin.html", {
         "request": request,
-        "comments": comments
+        "comments": page.items,
+        "page": page
     })
 
 @app.delete("/admin/comments/{comment_id}")
-async def delete_comment_endpoint(comment_id: int, request: Request):
-   
-    username = request.session.get("username")
-    if not username:
-        raise HTTPException(status_code=401)
-    
-    user = get_user_by_login(username)
-    if not user or not is_admin(user):
-        raise HTTPException(status_code=403)
-    
-   
-    if delete_comment(comment_id):
+async def delete_comment_endpoint(comment_id: int, user: SessionUser = Depends(require_admin)):
+    if await delete_comment(comment_id):
         return {"status": "success"}
     else:
         raise HTTPException(status_code=500, detail="Ошибка при удалении")
\ No newline at end of file
@@ -0,0 +1,446 @@
+import sqlite3
+from typing import List, Tuple
+
+from .normalize import normalize_key
+
+# Миграции применяются строго по возрастанию версии, каждая в своей транзакции.
+# Уже выпущенные шаги не редактируются — изменения схемы добавляются новым шагом.
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "базовая схема", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            login TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            is_admin BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tracks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            genre TEXT,
+            is_original BOOLEAN DEFAULT FALSE,
+            found_by INTEGER NOT NULL,
+            found_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (found_by) REFERENCES users(id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS discussions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            track_id INTEGER NOT NULL,
+            created_by INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (track_id) REFERENCES tracks(id),
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            discussion_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (discussion_id) REFERENCES discussions(id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        );
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed
+        ON cache_entries (namespace, accessed_at);
+        """,
+    ]),
+    (2, "индексы для профиля, форума и комментариев", [
+        """
+        CREATE INDEX IF NOT EXISTS idx_tracks_found_by
+        ON tracks (found_by, found_at);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_discussions_created
+        ON discussions (created_at);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_comments_discussion
+        ON comments (discussion_id, created_at);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_comments_created
+        ON comments (created_at);
+        """,
+    ]),
+    (3, "счётчики форума и активность обсуждений", [
+        """
+        CREATE TABLE IF NOT EXISTS forum_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS discussion_activity (
+            discussion_id INTEGER PRIMARY KEY,
+            comment_count INTEGER NOT NULL DEFAULT 0,
+            last_comment_at TIMESTAMP,
+            FOREIGN KEY (discussion_id) REFERENCES discussions(id)
+        );
+        """,
+        """
+        INSERT OR REPLACE INTO forum_counters (name, value)
+        SELECT 'discussions', COUNT(*) FROM discussions
+        UNION ALL
+        SELECT 'comments', COUNT(*) FROM comments;
+        """,
+        """
+        INSERT OR REPLACE INTO discussion_activity (discussion_id, comment_count, last_comment_at)
+        SELECT d.id, COUNT(c.id), MAX(c.created_at)
+        FROM discussions d
+        LEFT JOIN comments c ON c.discussion_id = d.id
+        GROUP BY d.id;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_discussions_insert
+        AFTER INSERT ON discussions
+        BEGIN
+            UPDATE forum_counters SET value = value + 1 WHERE name = 'discussions';
+            INSERT OR IGNORE INTO discussion_activity (discussion_id) VALUES (NEW.id);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_discussions_delete
+        AFTER DELETE ON discussions
+        BEGIN
+            UPDATE forum_counters SET value = value - 1 WHERE name = 'discussions';
+            DELETE FROM discussion_activity WHERE discussion_id = OLD.id;
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_comments_insert
+        AFTER INSERT ON comments
+        BEGIN
+            UPDATE forum_counters SET value = value + 1 WHERE name = 'comments';
+            UPDATE discussion_activity
+            SET comment_count = comment_count + 1,
+                last_comment_at = MAX(COALESCE(last_comment_at, ''), NEW.created_at)
+            WHERE discussion_id = NEW.discussion_id;
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_comments_delete
+        AFTER DELETE ON comments
+        BEGIN
+            UPDATE forum_counters SET value = value - 1 WHERE name = 'comments';
+            UPDATE discussion_activity
+            SET comment_count = comment_count - 1,
+                last_comment_at = (
+                    SELECT MAX(created_at) FROM comments
+                    WHERE discussion_id = OLD.discussion_id
+                )
+            WHERE discussion_id = OLD.discussion_id;
+        END;
+        """,
+    ]),
+    (4, "очередь задач распознавания", [
+        """
+        CREATE TABLE IF NOT EXISTS recognition_jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            file_path TEXT,
+            content_hash TEXT,
+            username TEXT,
+            result TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_recognition_jobs_status
+        ON recognition_jobs (status, created_at);
+        """,
+    ]),
+    (5, "полнотекстовый поиск по трекам, обсуждениям и комментариям", [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+            title, artist,
+            content='tracks', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        """,
+        """
+        INSERT INTO tracks_fts (tracks_fts) VALUES ('rebuild');
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tracks_fts_insert
+        AFTER INSERT ON tracks
+        BEGIN
+            INSERT INTO tracks_fts (rowid, title, artist) VALUES (NEW.id, NEW.title, NEW.artist);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tracks_fts_delete
+        AFTER DELETE ON tracks
+        BEGIN
+            INSERT INTO tracks_fts (tracks_fts, rowid, title, artist) VALUES ('delete', OLD.id, OLD.title, OLD.artist);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tracks_fts_update
+        AFTER UPDATE OF title, artist ON tracks
+        BEGIN
+            INSERT INTO tracks_fts (tracks_fts, rowid, title, artist) VALUES ('delete', OLD.id, OLD.title, OLD.artist);
+            INSERT INTO tracks_fts (rowid, title, artist) VALUES (NEW.id, NEW.title, NEW.artist);
+        END;
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS discussions_fts USING fts5(
+            title,
+            content='discussions', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        """,
+        """
+        INSERT INTO discussions_fts (discussions_fts) VALUES ('rebuild');
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_discussions_fts_insert
+        AFTER INSERT ON discussions
+        BEGIN
+            INSERT INTO discussions_fts (rowid, title) VALUES (NEW.id, NEW.title);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_discussions_fts_delete
+        AFTER DELETE ON discussions
+        BEGIN
+            INSERT INTO discussions_fts (discussions_fts, rowid, title) VALUES ('delete', OLD.id, OLD.title);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_discussions_fts_update
+        AFTER UPDATE OF title ON discussions
+        BEGIN
+            INSERT INTO discussions_fts (discussions_fts, rowid, title) VALUES ('delete', OLD.id, OLD.title);
+            INSERT INTO discussions_fts (rowid, title) VALUES (NEW.id, NEW.title);
+        END;
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS comments_fts USING fts5(
+            content,
+            content='comments', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        """,
+        """
+        INSERT INTO comments_fts (comments_fts) VALUES ('rebuild');
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_comments_fts_insert
+        AFTER INSERT ON comments
+        BEGIN
+            INSERT INTO comments_fts (rowid, content) VALUES (NEW.id, NEW.content);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_comments_fts_delete
+        AFTER DELETE ON comments
+        BEGIN
+            INSERT INTO comments_fts (comments_fts, rowid, content) VALUES ('delete', OLD.id, OLD.content);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_comments_fts_update
+        AFTER UPDATE OF content ON comments
+        BEGIN
+            INSERT INTO comments_fts (comments_fts, rowid, content) VALUES ('delete', OLD.id, OLD.content);
+            INSERT INTO comments_fts (rowid, content) VALUES (NEW.id, NEW.content);
+        END;
+        """,
+    ]),
+    (6, "каталог треков и ссылки пользователей на него", [
+        """
+        CREATE TABLE IF NOT EXISTS catalog (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            norm_key TEXT NOT NULL UNIQUE,
+            title TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            genre TEXT,
+            shazam_url TEXT,
+            platform_links TEXT,
+            found_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        # Написание названия берётся из самой ранней находки
+        """
+        INSERT INTO catalog (norm_key, title, artist, genre, created_at)
+        SELECT catalog_key(artist, title), title, artist, genre, MIN(found_at)
+        FROM tracks
+        GROUP BY catalog_key(artist, title);
+        """,
+        """
+        CREATE TABLE track_links (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            catalog_id INTEGER NOT NULL,
+            found_by INTEGER NOT NULL,
+            is_original BOOLEAN DEFAULT FALSE,
+            found_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (found_by, catalog_id),
+            FOREIGN KEY (catalog_id) REFERENCES catalog(id),
+            FOREIGN KEY (found_by) REFERENCES users(id)
+        );
+        """,
+        # Повторные находки одного трека пользователем сливаются в первую
+        """
+        CREATE TEMP TABLE track_remap AS
+        SELECT t.id AS old_id, c.id AS catalog_id, t.found_by,
+               MIN(t.id) OVER (PARTITION BY t.found_by, c.id) AS new_id
+        FROM tracks t
+        JOIN catalog c ON c.norm_key = catalog_key(t.artist, t.title);
+        """,
+        """
+        INSERT INTO track_links (id, catalog_id, found_by, is_original, found_at)
+        SELECT MIN(t.id), r.catalog_id, t.found_by, MAX(t.is_original), MIN(t.found_at)
+        FROM tracks t
+        JOIN track_remap r ON r.old_id = t.id
+        GROUP BY t.found_by, r.catalog_id;
+        """,
+        """
+        UPDATE discussions
+        SET track_id = (SELECT new_id FROM track_remap WHERE old_id = discussions.track_id)
+        WHERE track_id IN (SELECT old_id FROM track_remap WHERE old_id != new_id);
+        """,
+        """
+        UPDATE catalog SET found_count = (
+            SELECT COUNT(*) FROM track_links WHERE catalog_id = catalog.id
+        );
+        """,
+        "DROP TABLE track_remap;",
+        "DROP TRIGGER IF EXISTS trg_tracks_fts_insert;",
+        "DROP TRIGGER IF EXISTS trg_tracks_fts_delete;",
+        "DROP TRIGGER IF EXISTS trg_tracks_fts_update;",
+        "DROP TABLE IF EXISTS tracks_fts;",
+        "DROP TABLE tracks;",
+        "ALTER TABLE track_links RENAME TO tracks;",
+        """
+        CREATE INDEX IF NOT EXISTS idx_tracks_found_by
+        ON tracks (found_by, found_at);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_tracks_catalog
+        ON tracks (catalog_id);
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tracks_insert
+        AFTER INSERT ON tracks
+        BEGIN
+            UPDATE catalog SET found_count = found_count + 1 WHERE id = NEW.catalog_id;
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tracks_delete
+        AFTER DELETE ON tracks
+        BEGIN
+            UPDATE catalog SET found_count = found_count - 1 WHERE id = OLD.catalog_id;
+        END;
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS catalog_fts USING fts5(
+            title, artist,
+            content='catalog', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        """,
+        """
+        INSERT INTO catalog_fts (catalog_fts) VALUES ('rebuild');
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_fts_insert
+        AFTER INSERT ON catalog
+        BEGIN
+            INSERT INTO catalog_fts (rowid, title, artist) VALUES (NEW.id, NEW.title, NEW.artist);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_fts_delete
+        AFTER DELETE ON catalog
+        BEGIN
+            INSERT INTO catalog_fts (catalog_fts, rowid, title, artist) VALUES ('delete', OLD.id, OLD.title, OLD.artist);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_fts_update
+        AFTER UPDATE OF title, artist ON catalog
+        BEGIN
+            INSERT INTO catalog_fts (catalog_fts, rowid, title, artist) VALUES ('delete', OLD.id, OLD.title, OLD.artist);
+            INSERT INTO catalog_fts (rowid, title, artist) VALUES (NEW.id, NEW.title, NEW.artist);
+        END;
+        """,
+    ]),
+    (7, "владелец и аренда задач распознавания", [
+        """
+        ALTER TABLE recognition_jobs ADD COLUMN owner TEXT;
+        """,
+        """
+        ALTER TABLE recognition_jobs ADD COLUMN lease_until REAL;
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_recognition_jobs_lease
+        ON recognition_jobs (status, lease_until);
+        """,
+    ]),
+]
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Возвращает текущую версию схемы (0 для пустой базы)"""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """Применяет недостающие миграции и возвращает итоговую версию схемы"""
+    version = current_version(conn)
+    conn.commit()
+    # Нормализация ключа каталога нужна миграциям на уровне SQL
+    conn.create_function("catalog_key", 2, normalize_key, deterministic=True)
+    for step, name, statements in MIGRATIONS:
+        if step <= version:
+            continue
+        try:
+            conn.execute("BEGIN")
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_version (version, name) VALUES (?, ?)",
+                (step, name)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Ошибка миграции {step} ({name}): {e}")
+            raise
+        print(f"Применена миграция {step}: {name}")
+        version = step
+    return version
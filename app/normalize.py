@@ -0,0 +1,13 @@
+import re
+
+_SPACES_RE = re.compile(r"\s+")
+_NOISE_RE = re.compile(r"[^\w\s]")
+
+
+def normalize_key(artist: str, title: str) -> str:
+    """Нормализует пару (исполнитель, название) в ключ кэша и каталога"""
+    parts = []
+    for value in (artist, title):
+        value = _NOISE_RE.sub(" ", (value or "").casefold())
+        parts.append(_SPACES_RE.sub(" ", value).strip())
+    return "|".join(parts)
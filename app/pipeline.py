@@ -0,0 +1,225 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from . import deadline
+from .async_database import save_tracks
+from .breaker import CircuitOpen
+from .duckduckgo import SEARCH_MAX_WORKERS, search_track_async
+from .metrics import errors, outcomes
+from .normalize import normalize_key
+from .shazam import recognize_song
+from .uploads import SavedUpload, UploadRejected
+from .users import user_cache
+from .writebehind import write_behind
+
+logger = logging.getLogger(__name__)
+
+StageCallback = Callable[[str], Awaitable[None]]
+
+BATCH_RECOGNITION_CONCURRENCY = 8
+BATCH_SEARCH_CONCURRENCY = SEARCH_MAX_WORKERS
+
+# Проверка пропущена: сервис отключён предохранителем или исчерпан бюджет запроса
+DEGRADED_ERRORS = (CircuitOpen, deadline.DeadlineExceeded)
+
+ORIGINAL_RESULT = {
+    "status": "original",
+    "message": "Трек оригинален",
+    "originality_score": 100
+}
+
+
+def classify_search_results(shazam_data: Dict[str, Any],
+                            search_results: Optional[List[Dict[str, str]]]) -> Dict[str, Any]:
+    """Оценивает оригинальность по результатам поиска на платформах"""
+    if search_results is None:
+        originality = "unknown"
+        message = "Не удалось проверить на платформах"
+        originality_score = 50
+    else:
+        originality = "common" if len(search_results) >= 2 else "original"
+        message = ("Трек найден на популярных платформах" if originality == "common"
+                   else "Трек оригинален (не найден на музыкальных платформах)")
+        originality_score = 0 if originality == "common" else 80
+
+    return {
+        "status": "success",
+        "originality": originality,
+        "message": message,
+        "metadata": shazam_data,
+        "search_results": search_results if search_results else [],
+        "originality_score": originality_score
+    }
+
+
+def search_failed_result(shazam_data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "status": "search_failed",
+        "message": "Ошибка при проверке на платформах",
+        "metadata": shazam_data,
+        "originality_score": 50
+    }
+
+
+def degraded_result(shazam_data: Optional[Dict[str, Any]] = None,
+                    reason: Optional[Exception] = None) -> Dict[str, Any]:
+    """Ответ без полной проверки: оригинальность неизвестна"""
+    if isinstance(reason, deadline.DeadlineExceeded):
+        message = "Проверка не уложилась в отведённое время, попробуйте позже"
+    else:
+        message = "Сервис проверки временно недоступен, попробуйте позже"
+    return {
+        "status": "degraded",
+        "originality": "unknown",
+        "message": message,
+        "metadata": shazam_data,
+        "search_results": [],
+        "originality_score": 50
+    }
+
+
+def record_outcome(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Учитывает итог проверки в счётчике original/common/unknown"""
+    if result.get("status") == "original":
+        outcome = "original"
+    else:
+        outcome = result.get("originality", "unknown")
+    outcomes.inc(outcome=outcome)
+    return result
+
+
+async def _noop_stage(stage: str) -> None:
+    pass
+
+
+async def run_recognition(file_path: str, content_hash: Optional[str] = None,
+                          username: Optional[str] = None,
+                          on_stage: StageCallback = _noop_stage) -> Dict[str, Any]:
+    """Распознаёт загрузку, проверяет её на платформах и сохраняет находку"""
+    await on_stage("recognizing")
+    try:
+        shazam_data = await recognize_song(file_path, content_hash=content_hash)
+    except DEGRADED_ERRORS as e:
+        return record_outcome(degraded_result(reason=e))
+    if not shazam_data:
+        return record_outcome(dict(ORIGINAL_RESULT))
+
+    await on_stage("recognized")
+    try:
+        await on_stage("searching")
+        search_results = await search_track_async(title=shazam_data["title"], artist=shazam_data["artist"])
+        result = classify_search_results(shazam_data, search_results)
+
+        if username and result["originality"] == "common":
+            try:
+                user = await user_cache.get(username)
+                if user:
+                    await write_behind.save_track(
+                        user_id=user["id"],
+                        title=shazam_data["title"],
+                        artist=shazam_data["artist"],
+                        is_original=False,
+                        shazam_url=shazam_data.get("shazam_url"),
+                        platform_links=result["search_results"]
+                    )
+            except deadline.DeadlineExceeded as e:
+                # Результат уже есть: он важнее записи в историю
+                logger.warning(f"Находка не записана: {e}")
+
+        return record_outcome(result)
+    except DEGRADED_ERRORS as e:
+        return record_outcome(degraded_result(shazam_data, e))
+    except Exception as search_error:
+        errors.inc(stage="search")
+        logger.error(f"Search error: {search_error}")
+        return record_outcome(search_failed_result(shazam_data))
+
+
+async def run_batch(items: List[Tuple[str, Union[SavedUpload, UploadRejected]]],
+                    username: Optional[str] = None,
+                    deadline_at: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Распознаёт пакет файлов параллельно и отдаёт результаты по мере готовности.
+
+    Одинаковые (исполнитель, название) внутри пакета ищутся один раз, а все
+    найденные треки сохраняются одной транзакцией в конце. Файлы, на которые
+    не хватило бюджета deadline_at, получают ответ degraded.
+    """
+    recognize_slots = asyncio.Semaphore(BATCH_RECOGNITION_CONCURRENCY)
+    search_slots = asyncio.Semaphore(BATCH_SEARCH_CONCURRENCY)
+    searches: Dict[str, asyncio.Task] = {}
+
+    async def search_once(shazam_data: Dict[str, Any]):
+        async with search_slots:
+            return await search_track_async(title=shazam_data["title"], artist=shazam_data["artist"])
+
+    async def process(name: str, upload: SavedUpload) -> Dict[str, Any]:
+        # Дедлайн ставится внутри задачи: задачи поиска, созданные отсюда,
+        # наследуют его вместе с контекстом
+        with deadline.until(deadline_at):
+            return await process_file(name, upload)
+
+    async def process_file(name: str, upload: SavedUpload) -> Dict[str, Any]:
+        try:
+            async with recognize_slots:
+                shazam_data = await recognize_song(upload.path, content_hash=upload.content_hash)
+        except DEGRADED_ERRORS as e:
+            return record_outcome({"file": name, **degraded_result(reason=e)})
+        if not shazam_data:
+            return record_outcome({"file": name, **ORIGINAL_RESULT})
+
+        key = normalize_key(shazam_data["artist"], shazam_data["title"])
+        if key not in searches:
+            searches[key] = asyncio.create_task(search_once(shazam_data))
+        try:
+            search_results = await asyncio.shield(searches[key])
+        except DEGRADED_ERRORS as e:
+            return record_outcome({"file": name, **degraded_result(shazam_data, e)})
+        except Exception as search_error:
+            errors.inc(stage="search")
+            logger.error(f"Search error: {search_error}")
+            return record_outcome({"file": name, **search_failed_result(shazam_data)})
+        return record_outcome({"file": name, **classify_search_results(shazam_data, search_results)})
+
+    tasks = []
+    for name, item in items:
+        if isinstance(item, UploadRejected):
+            yield {"file": name, "status": "rejected", "message": item.detail}
+        else:
+            tasks.append(asyncio.create_task(process(name, item)))
+
+    hits: Dict[str, Dict[str, Any]] = {}
+    counts = {"files": len(items), "common": 0, "failed": 0}
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                result = await next_done
+            except Exception as e:
+                errors.inc(stage="batch_item")
+                logger.error(f"Batch item error: {e}")
+                counts["failed"] += 1
+                yield {"status": "error", "message": "Ошибка обработки файла"}
+                continue
+            if result.get("originality") == "common":
+                counts["common"] += 1
+                metadata = result["metadata"]
+                hits.setdefault(normalize_key(metadata["artist"], metadata["title"]), result)
+            yield result
+    finally:
+        for task in list(tasks) + list(searches.values()):
+            task.cancel()
+
+    saved = 0
+    if username and hits:
+        user = await user_cache.get(username)
+        if user:
+            rows = [(user["id"], hit["metadata"]["title"], hit["metadata"]["artist"], False,
+                     hit["metadata"].get("shazam_url"), hit["search_results"])
+                    for hit in hits.values()]
+            try:
+                with deadline.until(deadline_at):
+                    if await save_tracks(rows):
+                        saved = len(rows)
+            except deadline.DeadlineExceeded as e:
+                logger.warning(f"Находки пакета дописываются в фоне: {e}")
+    yield {"status": "summary", **counts, "saved_tracks": saved}
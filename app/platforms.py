@@ -0,0 +1,156 @@
+import re
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# Домен платформы -> (название, обязательный префикс пути или None).
+# Поддомены (www., m., open., listen., artist.bandcamp.com) находятся
+# отбрасыванием левых меток хоста.
+PLATFORM_HOSTS: Dict[str, Tuple[str, Optional[str]]] = {
+    "youtube.com": ("YouTube", None),
+    "youtu.be": ("YouTube", None),
+    "spotify.com": ("Spotify", None),
+    "music.apple.com": ("Apple Music", None),
+    "deezer.com": ("Deezer", None),
+    "music.yandex.ru": ("Yandex Music", None),
+    "music.yandex.com": ("Yandex Music", None),
+    "yandex.ru": ("Yandex Music", "/music"),
+    "soundcloud.com": ("SoundCloud", None),
+    "vk.com": ("VK Music", "/music"),
+    "bandcamp.com": ("Bandcamp", None),
+    "tidal.com": ("Tidal", None),
+    "amazon.com": ("Amazon Music", "/music"),
+    "music.amazon.com": ("Amazon Music", None),
+}
+
+# Запасной вариант для хостов, которых нет в таблице (например, зеркала вида
+# youtube.com.example.net): один скомпилированный шаблон по хосту,
+# именованная группа даёт платформу.
+_FALLBACK_RE = re.compile(
+    r"(?P<youtube>youtube\.com|youtu\.be)"
+    r"|(?P<spotify>spotify\.com)"
+    r"|(?P<apple>music\.apple\.com)"
+    r"|(?P<deezer>deezer\.com)"
+    r"|(?P<yandex>music\.yandex\.(?:ru|com))"
+    r"|(?P<soundcloud>soundcloud\.com)"
+    r"|(?P<bandcamp>bandcamp\.com)"
+    r"|(?P<tidal>tidal\.com)"
+)
+_FALLBACK_NAMES = {
+    "youtube": "YouTube",
+    "spotify": "Spotify",
+    "apple": "Apple Music",
+    "deezer": "Deezer",
+    "yandex": "Yandex Music",
+    "soundcloud": "SoundCloud",
+    "bandcamp": "Bandcamp",
+    "tidal": "Tidal",
+}
+
+_URL_PARTS_RE = re.compile(
+    r"(?:[A-Za-z][A-Za-z0-9+.-]*://)?(?:[^@/?#]*@)?([^:/?#]*)(?::\d*)?([^?#]*)(?:\?([^#]*))?"
+)
+_TRACK_PATH_RE = re.compile(r"/track/([^/?#]+)")
+_APPLE_SONG_RE = re.compile(r"/(\d+)(?:$|[/?#])")
+_VK_ID_RE = re.compile(r"(-?\d+_\d+)")
+_VK_AUDIO_RE = re.compile(r"(vk\.com/)(audio|music/album)(-?\d+_\d+)")
+_YANDEX_TRACK_RE = re.compile(r"(track/)\d+")
+_YOUTUBE_PATH_RE = re.compile(r"^/(?:shorts|embed|live)/([\w-]+)")
+_AMAZON_ASIN_RE = re.compile(r"/dp/([A-Z0-9]{10})")
+
+
+class PlatformMatch(NamedTuple):
+    platform: str
+    url: str
+    track_id: Optional[str]
+
+
+def _split_url(url: str) -> Tuple[str, str, str]:
+    """Разбор на (хост, путь, query) одним регулярным выражением вместо urllib"""
+    match = _URL_PARTS_RE.match(url)
+    return match.group(1).lower(), match.group(2), match.group(3) or ""
+
+
+def _lookup_host(host: str, path: str) -> Optional[str]:
+    start = 0
+    while start != -1:
+        entry = PLATFORM_HOSTS.get(host[start:])
+        if entry is not None:
+            platform, path_prefix = entry
+            if path_prefix is None or path.startswith(path_prefix):
+                return platform
+            return None
+        start = host.find(".", start)
+        if start != -1:
+            start += 1
+    return None
+
+
+def _query_param(query: str, name: str) -> Optional[str]:
+    for pair in query.split("&"):
+        key, _, value = pair.partition("=")
+        if key == name and value:
+            return value
+    return None
+
+
+def _track_id(platform: str, host: str, path: str, query: str) -> Optional[str]:
+    if platform == "YouTube":
+        if host.endswith("youtu.be"):
+            return path.strip("/") or None
+        match = _YOUTUBE_PATH_RE.match(path)
+        if match:
+            return match.group(1)
+        return _query_param(query, "v")
+    if platform == "Apple Music":
+        song = _query_param(query, "i")
+        if song:
+            return song
+        match = _APPLE_SONG_RE.search(path)
+        return match.group(1) if match else None
+    if platform == "VK Music":
+        match = _VK_ID_RE.search(path)
+        return match.group(1) if match else None
+    if platform == "SoundCloud":
+        parts = [part for part in path.split("/") if part]
+        return "/".join(parts[:2]) if len(parts) >= 2 else None
+    if platform == "Amazon Music":
+        asin = _query_param(query, "trackAsin")
+        if asin:
+            return asin
+        match = _AMAZON_ASIN_RE.search(path)
+        return match.group(1) if match else None
+    match = _TRACK_PATH_RE.search(path)
+    return match.group(1) if match else None
+
+
+def canonical_url(url: str, platform: str) -> str:
+    """Нормализует URL для музыкальных платформ"""
+    if platform == "VK Music":
+        return _VK_AUDIO_RE.sub(r"\1music/album/\3", url)
+    elif platform == "Yandex Music":
+        return _YANDEX_TRACK_RE.sub(r"\1", url)
+    return url
+
+
+def classify_url(url: str) -> Optional[PlatformMatch]:
+    """Определяет платформу, канонический URL и ID трека за один разбор URL"""
+    host, path, query = _split_url(url)
+
+    platform = _lookup_host(host, path)
+    if platform is None:
+        match = _FALLBACK_RE.search(host)
+        if match is None:
+            return None
+        platform = _FALLBACK_NAMES[match.lastgroup]
+
+    return PlatformMatch(
+        platform=platform,
+        url=canonical_url(url, platform),
+        track_id=_track_id(platform, host, path, query),
+    )
+
+
+@lru_cache(maxsize=64)
+def source_suffix_re(source: str) -> "re.Pattern[str]":
+    """Скомпилированный шаблон хвоста « - <платформа>...» в заголовке"""
+    return re.compile(rf"\s*-\s*{re.escape(source)}.*$", re.IGNORECASE)
@@ -0,0 +1,314 @@
+import abc
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence
+
+from duckduckgo_search import DDGS
+from duckduckgo_search.exceptions import RatelimitException
+
+from . import deadline
+from .breaker import OPEN, CircuitBreaker, CircuitOpen
+from .metrics import counter, errors, histogram, stage_seconds
+from .ratelimit import SharedTokenBucket, search_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PROVIDERS = os.getenv("SOUNDHOME_SEARCH_PROVIDERS", "ddgs,ddgs-html")
+
+# Задержка перед запасным запросом — p90 задержки основного провайдера по
+# последним PROVIDER_STATS_WINDOW вызовам; пока замеров мало, берётся
+# HEDGE_DEFAULT_DELAY.
+PROVIDER_STATS_WINDOW = 200
+HEDGE_QUANTILE = 0.9
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = 1.5
+HEDGE_MIN_DELAY = 0.2
+HEDGE_MAX_DELAY = 5.0
+PROVIDER_MAX_WORKERS = 8
+# Вызов дольше этого считается медленным для предохранителя провайдера
+PROVIDER_SLOW_CALL_SECONDS = 10.0
+# Таймаут HTTP-запроса DDGS; урезается до остатка бюджета запроса
+DDGS_TIMEOUT = 10
+
+provider_seconds = histogram(
+    "soundhome_search_provider_seconds",
+    "Задержка ответа провайдеров поиска",
+    ["provider"],
+)
+hedges = counter(
+    "soundhome_search_hedges_total",
+    "Запасные запросы к провайдерам поиска",
+    ["outcome"],
+)
+_rate_limit_seconds = stage_seconds.labels(stage="search_rate_limit_wait")
+
+
+class ProviderUnavailable(Exception):
+    """Провайдер отказался выполнять запрос, не обращаясь к сервису"""
+
+
+class LatencyStats:
+    """Скользящее окно задержек провайдера"""
+
+    def __init__(self, window: int = PROVIDER_STATS_WINDOW):
+        self._samples: "deque[float]" = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class SearchProvider(abc.ABC):
+    """Источник результатов поиска в формате DDGS.text: title, href, body"""
+
+    name = "base"
+
+    def __init__(self):
+        self.latency = LatencyStats()
+        self.calls = 0
+        self.failures = 0
+        self._seconds = provider_seconds.labels(provider=self.name)
+        self._errors = errors.labels(stage=f"provider_{self.name}")
+        self.breaker = CircuitBreaker(f"search_{self.name}", PROVIDER_SLOW_CALL_SECONDS)
+
+    def search(self, query: str, max_results: int, hedge: bool = False) -> List[Dict[str, str]]:
+        """Выполняет запрос; hedge=True означает запасной запрос, который не должен ждать.
+
+        При разомкнутом предохранителе сразу поднимает CircuitOpen. Задержка
+        провайдера считается после _acquire: локальное ожидание лимитера не
+        попадает ни в p90 для запасных запросов, ни в медленные вызовы
+        предохранителя.
+        """
+        self.breaker.before_call()
+        self.calls += 1
+        try:
+            self._acquire(hedge)
+        except BaseException:
+            # До сервиса запрос не дошёл: слот пробного вызова возвращается
+            self.breaker.release()
+            raise
+        started = time.perf_counter()
+        try:
+            results = self._search(query, max_results, hedge)
+        except (ProviderUnavailable, deadline.DeadlineExceeded):
+            self.breaker.release()
+            raise
+        except Exception:
+            self.failures += 1
+            self._errors.inc()
+            self.breaker.record(True, time.perf_counter() - started)
+            raise
+        elapsed = time.perf_counter() - started
+        self.breaker.record(False, elapsed)
+        self.latency.record(elapsed)
+        self._seconds.observe(elapsed)
+        return results
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        p50 = self.latency.quantile(0.5)
+        p90 = self.latency.quantile(HEDGE_QUANTILE)
+        return {
+            "calls": self.calls,
+            "errors": self.failures,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p90_ms": round(p90 * 1000, 1) if p90 is not None else None,
+            "breaker": self.breaker.state,
+        }
+
+    def _acquire(self, hedge: bool) -> None:
+        """Ожидание на своей стороне перед запросом, например токен лимитера"""
+
+    @abc.abstractmethod
+    def _search(self, query: str, max_results: int, hedge: bool) -> List[Dict[str, str]]:
+        """Сам запрос к сервису"""
+
+
+class DDGSProvider(SearchProvider):
+    """DuckDuckGo через duckduckgo_search с общим лимитером запросов"""
+
+    def __init__(self, name: str = "ddgs", backend: Optional[str] = None,
+                 rate_limiter: SharedTokenBucket = search_rate_limiter):
+        self.name = name
+        super().__init__()
+        self.backend = backend
+        self.rate_limiter = rate_limiter
+
+    def _acquire(self, hedge: bool) -> None:
+        if hedge:
+            # Запасной запрос не ждёт токен: при исчерпанном бюджете он бесполезен
+            if not self.rate_limiter.try_acquire():
+                raise ProviderUnavailable(f"{self.name}: нет свободных токенов")
+        else:
+            waited = self.rate_limiter.acquire(max_wait=deadline.remaining())
+            if waited is None:
+                # Токен освободится позже, чем истечёт бюджет запроса
+                raise deadline.exceeded("search_rate_limit")
+            _rate_limit_seconds.observe(waited)
+            if waited > 0:
+                logger.info(f"⏳ Ожидание лимитера запросов: {waited:.2f} сек")
+
+    def _search(self, query: str, max_results: int, hedge: bool) -> List[Dict[str, str]]:
+        options = {"backend": self.backend} if self.backend else {}
+        deadline.check("search_request")
+        with DDGS(timeout=math.ceil(deadline.timeout(DDGS_TIMEOUT))) as ddgs:
+            try:
+                results = list(ddgs.text(query, max_results=max_results, **options))
+            except RatelimitException:
+                self.rate_limiter.on_rate_limited()
+                raise
+        self.rate_limiter.on_success()
+        return results
+
+
+class StubProvider(SearchProvider):
+    """Фиксированный ответ без сети — для разработки без доступа к поиску"""
+
+    name = "stub"
+
+    def __init__(self, results: Sequence[Dict[str, str]] = (), delay: float = 0.0):
+        super().__init__()
+        self.results = list(results)
+        self.delay = delay
+
+    def _search(self, query: str, max_results: int, hedge: bool) -> List[Dict[str, str]]:
+        if self.delay:
+            time.sleep(self.delay)
+        return self.results[:max_results]
+
+
+PROVIDER_FACTORIES: Dict[str, Callable[[], SearchProvider]] = {
+    "ddgs": lambda: DDGSProvider(),
+    "ddgs-html": lambda: DDGSProvider("ddgs-html", backend="html"),
+    "ddgs-lite": lambda: DDGSProvider("ddgs-lite", backend="lite"),
+    "stub": lambda: StubProvider(),
+}
+
+
+class HedgedSearch:
+    """Запрос к основному провайдеру с запасными запросами к следующим.
+
+    Если основной не ответил за p90 своей задержки, запускается следующий
+    провайдер; побеждает первый ответ без ошибки. Ошибка основного сразу
+    передаёт запрос следующему. Если не ответил никто, поднимается ошибка
+    основного провайдера.
+    """
+
+    def __init__(self, providers: Sequence[SearchProvider]):
+        if not providers:
+            raise ValueError("Нужен хотя бы один провайдер поиска")
+        self.providers = list(providers)
+        self._executor = ThreadPoolExecutor(
+            max_workers=PROVIDER_MAX_WORKERS,
+            thread_name_prefix="search-provider"
+        )
+
+    def hedge_delay(self, primary: Optional[SearchProvider] = None) -> float:
+        primary = primary or self.providers[0]
+        if len(primary.latency) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        p90 = primary.latency.quantile(HEDGE_QUANTILE)
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, p90))
+
+    def available_providers(self) -> List[SearchProvider]:
+        """Провайдеры с неразомкнутым предохранителем; CircuitOpen, если таких нет"""
+        providers = [provider for provider in self.providers if provider.breaker.state != OPEN]
+        if not providers:
+            raise CircuitOpen("все провайдеры поиска временно отключены")
+        return providers
+
+    def check_available(self) -> None:
+        self.available_providers()
+
+    def search(self, query: str, max_results: int = 20) -> List[Dict[str, str]]:
+        # Провайдер с разомкнутым предохранителем пропускается: основным
+        # становится следующий, и он ждёт токен лимитера как обычный запрос
+        providers = self.available_providers()
+        primary = providers[0]
+        active: Dict[Future, SearchProvider] = {}
+        next_index = 0
+        primary_error: Optional[BaseException] = None
+        last_error: Optional[BaseException] = None
+
+        def fire() -> None:
+            nonlocal next_index
+            provider = providers[next_index]
+            hedge = next_index > 0
+            if hedge:
+                hedges.inc(outcome="fired")
+                logger.info(f"🛡 Запасной запрос к {provider.name}")
+            # Пул не переносит контекст: дедлайн запроса передаётся копией
+            future = self._executor.submit(contextvars.copy_context().run,
+                                           provider.search, query, max_results, hedge)
+            active[future] = provider
+            next_index += 1
+
+        fire()
+        while active:
+            left = deadline.remaining()
+            if left is not None and left <= 0:
+                raise deadline.exceeded("search_providers")
+            hedge_in = self.hedge_delay(primary) if next_index < len(providers) else None
+            timeouts = [t for t in (hedge_in, left) if t is not None]
+            done, _ = wait(active, timeout=min(timeouts) if timeouts else None, return_when=FIRST_COMPLETED)
+            if not done:
+                # Запасной запрос запускается, только если до дедлайна есть время
+                if hedge_in is not None and (left is None or hedge_in < left):
+                    fire()
+                continue
+
+            for future in done:
+                provider = active.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.warning(f"Провайдер {provider.name} не ответил: {e}")
+                    if provider is primary:
+                        primary_error = e
+                    last_error = e
+                    continue
+                if provider is not primary:
+                    hedges.inc(outcome="won")
+                return results
+
+            if not active and next_index < len(providers):
+                fire()
+
+        raise primary_error or last_error
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1),
+            "providers": {provider.name: provider.stats() for provider in self.providers},
+        }
+
+
+def build_search_backend(names: str = SEARCH_PROVIDERS) -> HedgedSearch:
+    """Собирает цепочку провайдеров из списка имён через запятую"""
+    providers = []
+    for name in (part.strip() for part in names.split(",")):
+        if not name:
+            continue
+        if name not in PROVIDER_FACTORIES:
+            raise ValueError(f"Неизвестный провайдер поиска: {name}")
+        providers.append(PROVIDER_FACTORIES[name]())
+    return HedgedSearch(providers)
+
+
+search_backend = build_search_backend()
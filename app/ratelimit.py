@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+RATE_LIMIT_DB_PATH = os.getenv("SOUNDHOME_RATELIMIT_DB", "ratelimit.sqlite")
+
+
+class SharedTokenBucket:
+    """Token bucket, общий для всех процессов через маленькую базу SQLite.
+
+    Состояние (токены, текущая скорость, время обновления) хранится в строке
+    таблицы и меняется под BEGIN IMMEDIATE, поэтому воркеры uvicorn делят один
+    бюджет. Скорость адаптивная: при ответе «rate limit» она уменьшается в
+    decrease_factor раз, после каждого успешного запроса растёт на increase_step.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float,
+                 min_rate: float, max_rate: float,
+                 increase_step: float, decrease_factor: float,
+                 path: str = RATE_LIMIT_DB_PATH):
+        self.name = name
+        self.initial_rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.path = path
+        self._local = threading.local()
+
+    def acquire(self, max_wait: Optional[float] = None) -> Optional[float]:
+        """Резервирует один токен и ждёт, только если бюджет исчерпан; возвращает время ожидания.
+
+        Если ждать пришлось бы дольше max_wait, токен не резервируется и
+        возвращается None.
+        """
+        with self._transaction() as conn:
+            now = time.time()
+            tokens, rate = self._refill(conn, now)
+            tokens -= 1
+            wait = max(0.0, -tokens / rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._save(conn, tokens, rate, now)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def try_acquire(self) -> bool:
+        """Берёт токен, только если он есть прямо сейчас; не ждёт"""
+        with self._transaction() as conn:
+            now = time.time()
+            tokens, rate = self._refill(conn, now)
+            if tokens < 1:
+                return False
+            self._save(conn, tokens - 1, rate, now)
+        return True
+
+    def on_success(self) -> None:
+        """Плавно поднимает скорость после успешного запроса"""
+        self._adjust_rate(lambda rate: rate + self.increase_step, drain=False)
+
+    def on_rate_limited(self) -> None:
+        """Резко снижает скорость и обнуляет запас токенов после отказа по лимиту"""
+        self._adjust_rate(lambda rate: rate * self.decrease_factor, drain=True)
+
+    def _adjust_rate(self, change, drain: bool) -> None:
+        with self._transaction() as conn:
+            now = time.time()
+            tokens, rate = self._refill(conn, now)
+            rate = min(self.max_rate, max(self.min_rate, change(rate)))
+            if drain:
+                tokens = min(tokens, 0.0)
+            self._save(conn, tokens, rate, now)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS token_buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    rate REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _refill(self, conn: sqlite3.Connection, now: float):
+        row = conn.execute(
+            "SELECT tokens, rate, updated_at FROM token_buckets WHERE name = ?",
+            (self.name,)
+        ).fetchone()
+        if row is None:
+            return self.burst, self.initial_rate
+        tokens, rate, updated_at = row
+        elapsed = max(0.0, now - updated_at)
+        return min(self.burst, tokens + elapsed * rate), rate
+
+    def _save(self, conn: sqlite3.Connection, tokens: float, rate: float, now: float) -> None:
+        conn.execute(
+            """INSERT OR REPLACE INTO token_buckets (name, tokens, rate, updated_at)
+            VALUES (?, ?, ?, ?)""",
+            (self.name, tokens, rate, now)
+        )
+
+
+search_rate_limiter = SharedTokenBucket(
+    "duckduckgo",
+    rate=0.5,
+    burst=3,
+    min_rate=0.05,
+    max_rate=2.0,
+    increase_step=0.02,
+    decrease_factor=0.5,
+)
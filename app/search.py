@@ -1,19 +1,25 @@
-from duckduckgo_search import DDGS
 from typing import List, Dict, Optional
 import re
 
+from .platforms import PlatformMatch, classify_url, source_suffix_re
+from .providers import search_backend
+
+SEARCH_PLATFORMS = {"YouTube", "Spotify", "Apple Music", "Deezer", "Yandex Music", "SoundCloud"}
+
+_TITLE_NOISE_RE = re.compile(r'\[.*?\]|\(.*?\)|\b(official|video|audio|mp3)\b', re.IGNORECASE)
+
 def search_by_query(query: str, genres: Optional[List[str]] = None, limit: int = 5) -> List[Dict[str, str]]:
     
     search_query = build_search_query(query, genres)
     
-    with DDGS() as ddgs:
-        results = []
-        for item in ddgs.text(search_query, max_results=limit*2):  
-            if len(results) >= limit:
-                break
-                
-            if is_valid_music_result(item, genres):
-                results.append(format_result(item))
+    results = []
+    for item in search_backend.search(search_query, max_results=limit*2):
+        if len(results) >= limit:
+            break
+            
+        match = classify_url(item["href"])
+        if is_valid_music_result(item, genres, match):
+            results.append(format_result(item, match))
     
     return results
 
@@ -30,18 +36,12 @@ def build_search_query(query: str, genres: Optional[List[str]]) -> str:
     
     return base
 
-def is_valid_music_result(item: Dict[str, str], genres: Optional[List[str]]) -> bool:
+def is_valid_music_result(item: Dict[str, str], genres: Optional[List[str]],
+                          match: Optional[PlatformMatch]) -> bool:
     
     title = item["title"].lower()
-    url = item["href"].lower()
-    
-    
-    music_platforms = [
-        "youtube.com", "spotify.com", "music.apple.com",
-        "deezer.com", "yandex.ru/music", "soundcloud.com"
-    ]
     
-    if not any(platform in url for platform in music_platforms):
+    if match is None or match.platform not in SEARCH_PLATFORMS:
         return False
     
     
@@ -74,9 +74,9 @@ def extract_genres_from_title(title: str) -> List[str]:
     
     return found_genres
 
-def format_result(item: Dict[str, str]) -> Dict[str, str]:
+def format_result(item: Dict[str, str], match: Optional[PlatformMatch]) -> Dict[str, str]:
     """Форматирует результат поиска"""
-    source = "YouTube" if "youtube.com" in item["href"] else "Spotify"
+    source = match.platform if match else "Other Music"
     
     return {
         "title": clean_title(item["title"], source),
@@ -87,7 +87,7 @@ def format_result(item: Dict[str, str]) -> Dict[str, str]:
 def clean_title(title: str, source: str) -> str:
     """Очищает заголовок от лишней информации"""
     
-    title = re.sub(rf'\s*-\s*{source}.*$', '', title, flags=re.IGNORECASE)
+    title = source_suffix_re(source).sub('', title)
     
-    title = re.sub(r'\[.*?\]|\(.*?\)|\b(official|video|audio|mp3)\b', '', title, flags=re.IGNORECASE)
+    title = _TITLE_NOISE_RE.sub('', title)
     return title.strip()
\ No newline at end of file
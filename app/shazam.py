@@ -1,25 +1,305 @@
 from shazamio import Shazam
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
+import asyncio
+import hashlib
+import io
 import logging
+import os
+import subprocess
+import time
+import wave
+
+from . import deadline
+from .breaker import CircuitBreaker, CircuitOpen
+from .cache import MISSING, recognition_cache
+from .metrics import errors, histogram, stage_seconds
+from .singleflight import recognition_flight
 
 logger = logging.getLogger(__name__)
 shazam = Shazam()
 
-async def recognize_song(file_path: str) -> Optional[Dict[str, Any]]:
-    """Распознаёт трек через Shazam и возвращает метаданные"""
+FINGERPRINT_RATE = 8000
+FINGERPRINT_FRAME_MS = 500
+FINGERPRINT_BANDS = 6
+# Кадр тише этого (RMS в отсчётах int16, около -50 dBFS) считается тишиной;
+# если громких кадров меньше доли FINGERPRINT_MIN_LOUD_FRAMES, отпечаток не
+# строится: у тихих и одинаковых вступлений он совпал бы у разных файлов
+FINGERPRINT_SILENCE_RMS = 100.0
+FINGERPRINT_MIN_LOUD_FRAMES = 0.5
+
+# Shazam строит подпись по нескольким секундам звука, поэтому вместо всего
+# файла отправляется короткое окно в моно 16 кГц. Окна пробуются по порядку
+# смещений, следующее — только если предыдущее не распознано.
+CLIP_SECONDS = float(os.getenv("SOUNDHOME_CLIP_SECONDS", "12"))
+CLIP_OFFSETS: Tuple[float, ...] = tuple(
+    float(offset) for offset in os.getenv("SOUNDHOME_CLIP_OFFSETS", "30,0,90").split(",") if offset.strip()
+)
+CLIP_RATE = 16000
+CLIP_MIN_SECONDS = 3
+
+# Ответ Shazam дольше этого считается медленным для предохранителя
+SHAZAM_SLOW_CALL_SECONDS = 15.0
+# Меньше этого до дедлайна запроса — новое окно в Shazam не отправляется
+SHAZAM_MIN_SECONDS = 2.0
+
+shazam_breaker = CircuitBreaker("shazam", SHAZAM_SLOW_CALL_SECONDS)
+
+_recognize_seconds = stage_seconds.labels(stage="recognize_song")
+_fingerprint_seconds = stage_seconds.labels(stage="fingerprint")
+_shazam_seconds = stage_seconds.labels(stage="shazam")
+_shazam_errors = errors.labels(stage="shazam")
+_clip_seconds = stage_seconds.labels(stage="clip_extract")
+
+shazam_payload_bytes = histogram(
+    "soundhome_shazam_payload_bytes",
+    "Размер аудио, отправленного в Shazam за одну попытку",
+    buckets=(64e3, 128e3, 256e3, 512e3, 1e6, 4e6, 16e6, 64e6),
+)
+shazam_windows = histogram(
+    "soundhome_shazam_windows",
+    "Окон записи, отправленных в Shazam за одно распознавание",
+    buckets=(0, 1, 2, 3, 5),
+)
+
+
+def file_sha256(file_path: str) -> str:
+    """Считает SHA-256 содержимого файла, читая его блоками"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def audio_fingerprint(audio) -> Optional[str]:
+    """Грубый локальный отпечаток окна записи, которое уходит в Shazam.
+
+    Сравнивается точным совпадением, поэтому находит файлы с тем же звуком
+    в окне (например, отличающиеся только тегами); перекодированный файл
+    обычно даёт другой отпечаток и распознаётся через Shazam. None — нет
+    numpy, окно слишком короткое, в основном тихое или биты вырождены.
+    """
     try:
-        data = await shazam.recognize(file_path)
-        if not data or "track" not in data:
-            logger.warning("No track found in Shazam response")
+        import numpy as np
+    except ImportError:
+        return None
+
+    audio = audio.set_frame_rate(FINGERPRINT_RATE)
+    samples = np.frombuffer(audio.raw_data, dtype=np.int16).astype(np.float32)
+    frame = FINGERPRINT_RATE * FINGERPRINT_FRAME_MS // 1000
+    frames_count = len(samples) // frame
+    if frames_count < 8:
+        return None
+
+    frames = samples[:frames_count * frame].reshape(frames_count, frame)
+    loud = np.sqrt(np.mean(frames ** 2, axis=1)) >= FINGERPRINT_SILENCE_RMS
+    if loud.mean() < FINGERPRINT_MIN_LOUD_FRAMES:
+        return None
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(frame), axis=1))
+    edges = np.geomspace(8, spectrum.shape[1], FINGERPRINT_BANDS + 1).astype(int)
+    bands = np.stack(
+        [spectrum[:, lo:hi].sum(axis=1) for lo, hi in zip(edges[:-1], edges[1:])],
+        axis=1
+    )
+    # Биты Haitsma-Kalker: знак изменения разности соседних полос во времени
+    band_diff = np.diff(bands, axis=1)
+    bits = (band_diff[1:] - band_diff[:-1]) > 0
+    if bits.all() or not bits.any():
+        return None
+    return hashlib.sha1(np.packbits(bits).tobytes()).hexdigest()
+
+
+def _read_wav_window(file_path: str, offset: float, seconds: float):
+    """Читает окно PCM WAV без чтения остального файла"""
+    from pydub import AudioSegment
+
+    with wave.open(file_path, "rb") as wav:
+        rate = wav.getframerate()
+        start = int(offset * rate)
+        if start >= wav.getnframes():
             return None
-        
+        wav.setpos(start)
+        data = wav.readframes(int(seconds * rate))
+        return AudioSegment(data=data, sample_width=wav.getsampwidth(),
+                            frame_rate=rate, channels=wav.getnchannels())
+
+
+def _ffmpeg_window(file_path: str, offset: float, seconds: float):
+    """Окно через ffmpeg: -ss/-t перед -i, на выходе только отрезок в моно 16 кГц"""
+    from pydub import AudioSegment
+
+    command = [
+        AudioSegment.converter, "-v", "error", "-nostdin",
+        "-ss", str(offset), "-t", str(seconds), "-i", file_path,
+        "-vn", "-ac", "1", "-ar", str(CLIP_RATE), "-f", "s16le", "-",
+    ]
+    result = subprocess.run(command, capture_output=True, check=True)
+    if not result.stdout:
+        return None
+    return AudioSegment(data=result.stdout, sample_width=2, frame_rate=CLIP_RATE, channels=1)
+
+
+def load_window(file_path: str, offset: float, seconds: float = CLIP_SECONDS):
+    """Декодирует только окно записи и приводит его к моно 16 кГц, 16 бит.
+
+    None — окно за концом записи или короче CLIP_MIN_SECONDS; ошибка
+    декодирования поднимается исключением.
+    """
+    # AudioSegment.from_file не годится: файл с расширением .wav он читает
+    # целиком и только потом режет
+    if file_path.lower().endswith(".wav"):
+        try:
+            audio = _read_wav_window(file_path, offset, seconds)
+        except (wave.Error, EOFError):
+            # Сжатые и float WAV модуль wave не читает — их декодирует ffmpeg
+            audio = _ffmpeg_window(file_path, offset, seconds)
+    else:
+        audio = _ffmpeg_window(file_path, offset, seconds)
+
+    if audio is None or audio.duration_seconds < CLIP_MIN_SECONDS:
+        return None
+    return audio.set_channels(1).set_frame_rate(CLIP_RATE).set_sample_width(2)
+
+
+def clip_bytes(audio) -> bytes:
+    """WAV-файл окна в памяти"""
+    buffer = io.BytesIO()
+    audio.export(buffer, format="wav")
+    return buffer.getvalue()
+
+
+def extract_clip(file_path: str, offset: float, seconds: float = CLIP_SECONDS) -> Optional[bytes]:
+    """Вырезает окно записи и возвращает его как WAV моно 16 кГц в памяти"""
+    audio = load_window(file_path, offset, seconds)
+    return None if audio is None else clip_bytes(audio)
+
+
+def first_window(file_path: str) -> Tuple[int, Optional[bytes], Optional[str]]:
+    """Первое окно из CLIP_OFFSETS, которое удалось вырезать, и его отпечаток.
+
+    Возвращает (номер смещения, WAV окна, отпечаток); если окон нет —
+    (len(CLIP_OFFSETS), None, None). Ошибка декодирования поднимается.
+    """
+    for index, offset in enumerate(CLIP_OFFSETS):
+        with _clip_seconds.time():
+            audio = load_window(file_path, offset)
+        if audio is None:
+            continue
+        with _fingerprint_seconds.time():
+            fingerprint = audio_fingerprint(audio)
+        return index, clip_bytes(audio), fingerprint
+    return len(CLIP_OFFSETS), None, None
+
+
+async def _send_window(clip) -> Optional[Dict[str, Any]]:
+    deadline.check("shazam", need=SHAZAM_MIN_SECONDS)
+    shazam_payload_bytes.observe(len(clip) if isinstance(clip, bytes) else os.path.getsize(clip))
+    # Таймаут по бюджету применяется внутри предохранителя, чтобы зависший
+    # Shazam засчитывался ему как ошибка
+    try:
+        return await shazam_breaker.acall(shazam.recognize, clip, timeout=deadline.timeout())
+    except asyncio.TimeoutError:
+        raise deadline.exceeded("shazam") from None
+
+
+async def _shazam_windows(file_path: str, index: int, clip: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    """Отправляет в Shazam окна записи по очереди до первого совпадения.
+
+    clip — уже вырезанное окно со смещением CLIP_OFFSETS[index], остальные
+    вырезаются по мере надобности. Если ни одного окна нет (нет pydub, файл
+    не декодируется, запись короче CLIP_MIN_SECONDS), отправляется весь
+    файл, как раньше. Каждый вызов ограничен остатком бюджета запроса;
+    окно, на которое бюджета не хватает, не отправляется (DeadlineExceeded).
+    """
+    sent = 0
+    data = None
+    for offset in CLIP_OFFSETS[index:]:
+        if clip is None:
+            deadline.check("shazam", need=SHAZAM_MIN_SECONDS)
+            try:
+                with _clip_seconds.time():
+                    clip = await asyncio.to_thread(extract_clip, file_path, offset)
+            except Exception as e:
+                # Остальные окна того же файла не декодируются так же
+                logger.warning(f"Не удалось вырезать окно {offset:g} сек: {e}")
+                break
+            if clip is None:
+                continue
+        sent += 1
+        data = await _send_window(clip)
+        if data and "track" in data:
+            break
+        logger.info(f"Окно {offset:g} сек не распознано")
+        clip = None
+
+    if not sent:
+        sent = 1
+        data = await _send_window(file_path)
+    shazam_windows.observe(sent)
+    return data
+
+
+async def recognize_song(file_path: str, content_hash: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Распознаёт трек через Shazam и возвращает метаданные.
+
+    CircuitOpen — Shazam отключён предохранителем, DeadlineExceeded — не
+    хватило бюджета запроса; ни то, ни другое не кэшируется.
+    """
+    with _recognize_seconds.time():
+        content_hash = content_hash or await asyncio.to_thread(file_sha256, file_path)
+        return await recognition_flight.do(content_hash, lambda: _recognize(file_path, content_hash))
+
+
+async def _recognize(file_path: str, content_hash: str) -> Optional[Dict[str, Any]]:
+    keys = [f"sha256:{content_hash}"]
+    cached = await recognition_cache.aget(keys[0])
+    if cached is not MISSING:
+        logger.info("Распознавание из кэша по хешу содержимого")
+        return cached
+
+    # Окно для Shazam декодируется один раз: по нему же строится отпечаток
+    try:
+        index, clip, fingerprint = await asyncio.to_thread(first_window, file_path)
+    except Exception as e:
+        logger.warning(f"Не удалось вырезать окно {CLIP_OFFSETS[0]:g} сек: {e}")
+        index, clip, fingerprint = len(CLIP_OFFSETS), None, None
+    if fingerprint:
+        keys.append(f"clipfp:{fingerprint}")
+        cached = await recognition_cache.aget(keys[1])
+        if cached is not MISSING:
+            logger.info("Распознавание из кэша по аудио-отпечатку")
+            await recognition_cache.aset(keys[0], cached)
+            return cached
+
+    started = time.perf_counter()
+    try:
+        data = await _shazam_windows(file_path, index, clip)
+    except CircuitOpen:
+        # Не кэшируется: после восстановления Shazam файл распознается заново
+        logger.warning("Shazam отключён предохранителем, распознавание пропущено")
+        raise
+    except deadline.DeadlineExceeded as e:
+        logger.warning(f"Распознавание прервано: {e}")
+        raise
+    except Exception as e:
+        _shazam_errors.inc()
+        logger.error(f"Shazam recognition error: {e}")
+        return None
+    finally:
+        _shazam_seconds.observe(time.perf_counter() - started)
+
+    result = None
+    if not data or "track" not in data:
+        logger.warning("No track found in Shazam response")
+    else:
         track = data["track"]
-        return {
+        result = {
             "title": track.get("title", "Unknown Title"),
             "artist": track.get("subtitle", "Unknown Artist"),
             "genres": track.get("genres", {}).get("primary", ""),
             "shazam_url": track.get("url", ""),
         }
-    except Exception as e:
-        logger.error(f"Shazam recognition error: {e}")
-        return None
\ No newline at end of file
+
+    for key in keys:
+        await recognition_cache.aset(key, result)
+    return result
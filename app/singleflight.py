@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from . import deadline
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом в один запрос.
+
+    Первый вызывающий запускает работу, остальные ждут тот же future.
+    Отмена одного из ожидающих не отменяет работу для остальных. Работа
+    идёт до самого позднего дедлайна среди ожидающих, а каждый из них
+    ждёт не дольше своего бюджета.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight: Dict[str, Tuple[asyncio.Future, deadline.SharedDeadline]] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            future, shared = inflight
+            shared.extend(deadline.current())
+            self.coalesced += 1
+            logger.info(f"🔗 {self.name}: запрос объединён с уже выполняющимся ({key})")
+        else:
+            shared = deadline.SharedDeadline(deadline.current())
+            with deadline.until(shared):
+                future = asyncio.ensure_future(func())
+            self._inflight[key] = (future, shared)
+            future.add_done_callback(lambda done: self._forget(key, done))
+        return await deadline.wait_for(asyncio.shield(future), f"{self.name}_wait")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
+
+    def _forget(self, key: str, future: asyncio.Future) -> None:
+        inflight = self._inflight.get(key)
+        if inflight is not None and inflight[0] is future:
+            del self._inflight[key]
+        # Если все ожидающие отменились, исключение некому забрать
+        if not future.cancelled():
+            future.exception()
+
+
+recognition_flight = SingleFlight("recognition")
+search_flight = SingleFlight("search")
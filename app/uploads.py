@@ -0,0 +1,310 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple, Union
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from .metrics import stage_seconds
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("SOUNDHOME_MAX_UPLOAD_MB", "50")) * 1024 * 1024
+UPLOAD_DIR = Path(tempfile.gettempdir()) / "soundhome_uploads"
+
+MAX_BATCH_FILES = 100
+MAX_BATCH_BYTES = int(os.getenv("SOUNDHOME_MAX_BATCH_MB", "500")) * 1024 * 1024
+# Аудио почти не сжимается: запись архива, которая распаковывается во много
+# раз больше сжатого размера, — zip-бомба, а не аудиофайл
+MAX_COMPRESSION_RATIO = 20
+ARCHIVE_EXTENSIONS = {".zip"}
+ARCHIVE_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed"}
+
+_read_seconds = stage_seconds.labels(stage="upload_read")
+_write_seconds = stage_seconds.labels(stage="upload_write")
+
+# Запас на заголовки и границы multipart поверх лимита на сам файл
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+ALLOWED_EXTENSIONS = {".mp3", ".wav", ".ogg", ".oga", ".flac", ".m4a", ".aac", ".mp4", ".webm", ".opus"}
+
+# Сигнатуры распространённых аудиоконтейнеров: (смещение, байты)
+AUDIO_SIGNATURES = [
+    (0, b"ID3"),
+    (0, b"\xff\xfb"),
+    (0, b"\xff\xf3"),
+    (0, b"\xff\xf2"),
+    (0, b"\xff\xf1"),
+    (0, b"\xff\xf9"),
+    (0, b"RIFF"),
+    (0, b"OggS"),
+    (0, b"fLaC"),
+    (4, b"ftyp"),
+    (0, b"\x1a\x45\xdf\xa3"),
+]
+
+
+class UploadRejected(Exception):
+    """Загрузка отклонена до окончания чтения"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class UploadTooLarge(HTTPException):
+    """Тело запроса превысило лимит. HTTPException: FastAPI пропускает его
+    из разбора формы как есть, а не превращает в 400"""
+
+    def __init__(self):
+        super().__init__(status_code=413, detail="Файл слишком большой")
+
+
+class UploadSizeLimit:
+    """ASGI-middleware: ограничивает размер тела POST-загрузок.
+
+    Запрос с Content-Length больше лимита отклоняется сразу; тело без
+    Content-Length (chunked) считается по мере чтения, и разбор multipart
+    обрывается, как только лимит превышен, — до записи всего тела на диск.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        limit += MULTIPART_OVERHEAD_BYTES
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise UploadTooLarge()
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except UploadTooLarge:
+            if started:
+                raise
+            await self._reject(scope, receive, send)
+
+    @staticmethod
+    async def _reject(scope, receive, send) -> None:
+        response = JSONResponse({"detail": "Файл слишком большой"}, status_code=413)
+        await response(scope, receive, send)
+
+
+class SavedUpload(NamedTuple):
+    path: str
+    content_hash: str
+    size: int
+
+
+def looks_like_audio(head: bytes) -> bool:
+    """Проверяет первые байты файла на сигнатуру аудиоформата"""
+    return any(head[offset:offset + len(magic)] == magic for offset, magic in AUDIO_SIGNATURES)
+
+
+def check_upload_headers(file: UploadFile) -> None:
+    """Отклоняет явно не-аудио загрузки по типу и расширению"""
+    content_type = (file.content_type or "").lower()
+    extension = Path(file.filename or "").suffix.lower()
+    if content_type.startswith("audio/") or extension in ALLOWED_EXTENSIONS:
+        return
+    raise UploadRejected(415, "Поддерживаются только аудиофайлы")
+
+
+def is_archive(file: UploadFile) -> bool:
+    """Проверяет, загружен ли zip-архив с несколькими записями"""
+    extension = Path(file.filename or "").suffix.lower()
+    return extension in ARCHIVE_EXTENSIONS or (file.content_type or "").lower() in ARCHIVE_CONTENT_TYPES
+
+
+def _new_upload_path(filename: str) -> Tuple[int, str]:
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    suffix = Path(filename or "").suffix.lower()[:10]
+    return tempfile.mkstemp(prefix="upload_", suffix=suffix, dir=UPLOAD_DIR)
+
+
+async def save_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES,
+                      check_audio: bool = True) -> SavedUpload:
+    """Потоково сохраняет загрузку в уникальный временный файл и считает её хеш"""
+    if check_audio:
+        check_upload_headers(file)
+    fd, path = _new_upload_path(file.filename)
+
+    digest = hashlib.sha256()
+    size = 0
+    read_time = write_time = 0.0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                started = time.perf_counter()
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                read_time += time.perf_counter() - started
+                if not chunk:
+                    break
+                if size == 0 and check_audio and not looks_like_audio(chunk):
+                    raise UploadRejected(415, "Файл не похож на аудиозапись")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(413, "Файл слишком большой")
+                digest.update(chunk)
+                started = time.perf_counter()
+                await asyncio.to_thread(out.write, chunk)
+                write_time += time.perf_counter() - started
+        if size == 0:
+            raise UploadRejected(400, "Пустой файл")
+    except BaseException:
+        remove_upload(path)
+        raise
+
+    _read_seconds.observe(read_time)
+    _write_seconds.observe(write_time)
+    return SavedUpload(path=path, content_hash=digest.hexdigest(), size=size)
+
+
+def remove_upload(path: str) -> None:
+    """Удаляет временный файл загрузки, если он ещё существует"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _batch_too_large() -> UploadRejected:
+    return UploadRejected(413, f"Пакет после распаковки больше {MAX_BATCH_BYTES // (1024 * 1024)} МБ")
+
+
+def _extract_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, max_bytes: int,
+                    total_left: int) -> Union[SavedUpload, UploadRejected]:
+    """Распаковывает одну запись; превышение общего лимита пакета поднимается исключением"""
+    fd, path = _new_upload_path(info.filename)
+    digest = hashlib.sha256()
+    size = 0
+    max_ratio_size = max(info.compress_size, 1) * MAX_COMPRESSION_RATIO
+    try:
+        with os.fdopen(fd, "wb") as out, archive.open(info) as member:
+            for chunk in iter(lambda: member.read(UPLOAD_CHUNK_SIZE), b""):
+                if size == 0 and not looks_like_audio(chunk):
+                    raise UploadRejected(415, "Файл не похож на аудиозапись")
+                size += len(chunk)
+                # file_size в заголовке архива может быть подделан
+                if size > total_left:
+                    raise _batch_too_large()
+                if size > max_bytes:
+                    raise UploadRejected(413, "Файл слишком большой")
+                if size > max_ratio_size:
+                    raise UploadRejected(413, "Файл в архиве подозрительно сильно сжат")
+                digest.update(chunk)
+                out.write(chunk)
+    except UploadRejected as e:
+        remove_upload(path)
+        if size > total_left:
+            raise
+        return e
+    except BaseException:
+        remove_upload(path)
+        raise
+    return SavedUpload(path=path, content_hash=digest.hexdigest(), size=size)
+
+
+def extract_archive(archive_path: str, max_files: int = MAX_BATCH_FILES,
+                    max_bytes: int = MAX_UPLOAD_BYTES,
+                    max_total: int = MAX_BATCH_BYTES) -> List[Tuple[str, Union[SavedUpload, UploadRejected]]]:
+    """Распаковывает аудиофайлы из zip-архива во временные файлы, считая их хеши.
+
+    Весь пакет отклоняется (413), если распакованные записи вместе больше
+    max_total; запись со степенью сжатия выше MAX_COMPRESSION_RATIO
+    отклоняется по отдельности.
+    """
+    items: List[Tuple[str, Union[SavedUpload, UploadRejected]]] = []
+    total = 0
+    try:
+        archive = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile:
+        raise UploadRejected(415, "Повреждённый zip-архив")
+
+    try:
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir() or Path(info.filename).suffix.lower() not in ALLOWED_EXTENSIONS:
+                    continue
+                if len(items) >= max_files:
+                    raise UploadRejected(413, f"В пакете больше {max_files} файлов")
+                if info.file_size > max_bytes:
+                    items.append((info.filename, UploadRejected(413, "Файл слишком большой")))
+                    continue
+                if info.file_size > max(info.compress_size, 1) * MAX_COMPRESSION_RATIO:
+                    items.append((info.filename, UploadRejected(413, "Файл в архиве подозрительно сильно сжат")))
+                    continue
+                if total + info.file_size > max_total:
+                    raise _batch_too_large()
+                item = _extract_member(archive, info, max_bytes, max_total - total)
+                if isinstance(item, SavedUpload):
+                    total += item.size
+                items.append((info.filename, item))
+    except BaseException:
+        for _, item in items:
+            if isinstance(item, SavedUpload):
+                remove_upload(item.path)
+        raise
+    return items
+
+
+def _saved_bytes(items: List[Tuple[str, Union[SavedUpload, UploadRejected]]]) -> int:
+    return sum(item.size for _, item in items if isinstance(item, SavedUpload))
+
+
+async def save_batch(files: List[UploadFile]) -> List[Tuple[str, Union[SavedUpload, UploadRejected]]]:
+    """Сохраняет пакет загрузок; zip-архивы распаковываются в отдельные записи"""
+    items: List[Tuple[str, Union[SavedUpload, UploadRejected]]] = []
+    try:
+        for file in files:
+            if is_archive(file):
+                archive = await save_upload(file, max_bytes=MAX_BATCH_BYTES, check_audio=False)
+                try:
+                    items.extend(await asyncio.to_thread(
+                        extract_archive, archive.path, MAX_BATCH_FILES - len(items),
+                        MAX_UPLOAD_BYTES, MAX_BATCH_BYTES - _saved_bytes(items)
+                    ))
+                finally:
+                    remove_upload(archive.path)
+            else:
+                try:
+                    items.append((file.filename, await save_upload(file)))
+                except UploadRejected as e:
+                    items.append((file.filename, e))
+            if len(items) > MAX_BATCH_FILES:
+                raise UploadRejected(413, f"В пакете больше {MAX_BATCH_FILES} файлов")
+    except BaseException:
+        for _, item in items:
+            if isinstance(item, SavedUpload):
+                remove_upload(item.path)
+        raise
+    return items
@@ -0,0 +1,104 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Request
+
+from .async_database import get_user_by_login
+from .metrics import cache_requests
+
+USER_CACHE_TTL = 300
+USER_CACHE_MAX_ENTRIES = 10000
+
+
+class SessionUser(NamedTuple):
+    id: int
+    login: str
+    is_admin: bool
+
+
+class UserCache:
+    """TTL-кэш строк пользователей по логину; используется только из цикла событий"""
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_entries: int = USER_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._hits = cache_requests.labels(cache="users", result="memory_hit")
+        self._misses = cache_requests.labels(cache="users", result="miss")
+
+    async def get(self, login: str) -> Optional[Dict[str, Any]]:
+        """Строка пользователя без пароля; в БД идёт только при промахе"""
+        now = time.monotonic()
+        entry = self._entries.get(login)
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end(login)
+            self._hits.inc()
+            return entry[1]
+
+        self._misses.inc()
+        row = await get_user_by_login(login)
+        if row is None:
+            self._entries.pop(login, None)
+            return None
+        user = {key: row[key] for key in row.keys() if key != "password"}
+        self._entries[login] = (now + self.ttl, user)
+        self._entries.move_to_end(login)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, login: str) -> None:
+        """Сбрасывает запись после изменения пользователя"""
+        self._entries.pop(login, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+def remember_user(request: Request, user: Dict[str, Any]) -> SessionUser:
+    """Сохраняет ID и флаг администратора в сессии, чтобы не искать пользователя снова"""
+    request.session["username"] = user["login"]
+    request.session["user_id"] = user["id"]
+    request.session["is_admin"] = bool(user["is_admin"])
+    return SessionUser(user["id"], user["login"], bool(user["is_admin"]))
+
+
+async def current_user(request: Request) -> Optional[SessionUser]:
+    """Зависимость FastAPI: пользователь сессии или None; ID берётся из сессии без запроса к БД"""
+    login = request.session.get("username")
+    if not login:
+        return None
+    if "user_id" in request.session:
+        return SessionUser(request.session["user_id"], login, bool(request.session.get("is_admin")))
+
+    # Сессии, созданные до появления user_id, дополняются один раз
+    user = await user_cache.get(login)
+    if user is None:
+        return None
+    return remember_user(request, user)
+
+
+async def require_user(user: Optional[SessionUser] = Depends(current_user)) -> SessionUser:
+    """Зависимость для API: 401 без авторизации"""
+    if user is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return user
+
+
+async def require_admin(user: SessionUser = Depends(require_user)) -> SessionUser:
+    """Зависимость для API администратора: флаг перепроверяется по кэшу, а не по сессии"""
+    if not await is_admin_user(user):
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+    return user
+
+
+async def is_admin_user(user: Optional[SessionUser]) -> bool:
+    """Актуальный флаг администратора: права могли отозвать после входа"""
+    if user is None or not user.is_admin:
+        return False
+    row = await user_cache.get(user.login)
+    return bool(row and row["is_admin"])
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from . import deadline
+from .async_database import add_comment, insert_batch, save_track
+from .metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+# Пачка сбрасывается, когда набралось WRITE_BATCH_MAX_ROWS строк или прошло
+# WRITE_BATCH_MAX_DELAY секунд с первой строки. Пока идёт запись, новые строки
+# копятся в очереди и уходят следующей пачкой.
+WRITE_BATCH_MAX_ROWS = 500
+WRITE_BATCH_MAX_DELAY = 0.002
+WRITE_QUEUE_SIZE = 10000
+
+TRACK = "track"
+COMMENT = "comment"
+
+batch_rows = histogram(
+    "soundhome_write_batch_rows",
+    "Строк в одной транзакции отложенной записи",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+dropped_writes = counter(
+    "soundhome_write_behind_failed_total",
+    "Строки, которые не удалось записать",
+    ["kind"],
+)
+
+_Item = Tuple[str, tuple, Optional[asyncio.Future]]
+
+
+class WriteBehindQueue:
+    """Отложенная пакетная запись треков и комментариев в одной транзакции.
+
+    Треки пишутся без ожидания (история находок), комментарии — с ожиданием
+    фактической записи. Без запущенного воркера запись идёт напрямую.
+    """
+
+    def __init__(self, max_rows: int = WRITE_BATCH_MAX_ROWS,
+                 max_delay: float = WRITE_BATCH_MAX_DELAY,
+                 queue_size: int = WRITE_QUEUE_SIZE):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._queue: "asyncio.Queue[Optional[_Item]]" = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Дописывает всё, что уже в очереди, и останавливает воркер"""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        await self._queue.put(None)
+        await task
+
+    async def save_track(self, user_id: int, title: str, artist: str, is_original: bool,
+                         shazam_url: Optional[str] = None,
+                         platform_links: Optional[Sequence[Dict[str, str]]] = None) -> bool:
+        """Ставит трек в очередь, не дожидаясь записи"""
+        row = (user_id, title, artist, is_original, shazam_url, platform_links)
+        if self._task is None:
+            return await save_track(*row)
+        # Полная очередь не задерживает ответ дольше бюджета запроса
+        await deadline.wait_for(self._queue.put((TRACK, row, None)), "write_behind")
+        return True
+
+    async def add_comment(self, discussion_id: int, user_id: int, content: str) -> bool:
+        """Ставит комментарий в очередь и ждёт, пока его пачка будет записана"""
+        row = (discussion_id, user_id, content)
+        if self._task is None:
+            return await add_comment(*row)
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put((COMMENT, row, done))
+        return await done
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            stopping = self._drain(batch)
+            if not stopping and len(batch) < self.max_rows and self.max_delay > 0:
+                await asyncio.sleep(self.max_delay)
+                stopping = self._drain(batch)
+            await self._flush(batch)
+
+    def _drain(self, batch: List[_Item]) -> bool:
+        """Добирает строки из очереди без ожидания; True, если встретился сигнал остановки"""
+        while len(batch) < self.max_rows:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return False
+            if item is None:
+                return True
+            batch.append(item)
+        return False
+
+    async def _flush(self, batch: List[_Item]) -> None:
+        tracks = [item for item in batch if item[0] == TRACK]
+        comments = [item for item in batch if item[0] == COMMENT]
+        batch_rows.observe(len(batch))
+        try:
+            track_results, comment_results = await insert_batch(
+                [row for _, row, _ in tracks],
+                [row for _, row, _ in comments],
+            )
+        except Exception as e:
+            logger.error(f"Ошибка отложенной записи: {e}")
+            track_results = [False] * len(tracks)
+            comment_results = [False] * len(comments)
+
+        for kind, items, results in ((TRACK, tracks, track_results), (COMMENT, comments, comment_results)):
+            for (_, _, done), ok in zip(items, results):
+                if not ok:
+                    dropped_writes.inc(kind=kind)
+                if done is not None and not done.done():
+                    done.set_result(ok)
+
+
+write_behind = WriteBehindQueue()
@@ -0,0 +1,148 @@
+"""Подготовка аудио для Shazam: весь файл против коротких окон.
+
+Для WAV разной длины (44.1 кГц, стерео) сравнивается прежний путь — весь
+файл декодируется и сводится в моно 16 кГц, как это делает shazamio, и
+целиком уходит в recognize — с app.shazam.extract_clip: одно окно при
+распознавании с первой попытки и все окна CLIP_OFFSETS при промахе.
+Меряются процессорное время, пик памяти Python (tracemalloc) и объём
+отправляемых данных.
+
+Отдельно меряется recognize_song целиком (хеш, окно с отпечатком, кэш,
+вызовы Shazam) с локальным заменителем Shazam, который узнаёт всё или
+ничего, против прежнего пути: хеш, отпечаток по первым 20 секундам через
+AudioSegment.from_file и весь файл в Shazam. Сеть не участвует.
+
+    python benchmarks/bench_clips.py --minutes 0.5 3 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("SOUNDHOME_DB", os.path.join(tempfile.mkdtemp(prefix="soundhome_clips_db_"), "bench.sqlite"))
+
+from pydub import AudioSegment  # noqa: E402
+
+from app import async_database, shazam  # noqa: E402
+from app.shazam import CLIP_OFFSETS, CLIP_RATE, extract_clip, file_sha256, recognize_song  # noqa: E402
+from benchmarks.fakes import FakesConfig, FakeShazam, LatencyModel  # noqa: E402
+
+SOURCE_RATE = 44100
+SOURCE_CHANNELS = 2
+
+
+def write_wav(path: str, seconds: float) -> None:
+    """Записывает шум нужной длины кусками, не держа файл в памяти"""
+    frames = int(seconds * SOURCE_RATE)
+    chunk = SOURCE_RATE * 10
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(SOURCE_CHANNELS)
+        wav.setsampwidth(2)
+        wav.setframerate(SOURCE_RATE)
+        for start in range(0, frames, chunk):
+            wav.writeframes(os.urandom(min(chunk, frames - start) * SOURCE_CHANNELS * 2))
+
+
+def full_file(path: str) -> int:
+    audio = AudioSegment.from_file(path)
+    audio.set_sample_width(2).set_frame_rate(CLIP_RATE).set_channels(1)
+    return os.path.getsize(path)
+
+
+def windows(path: str, count: int) -> int:
+    """Вырезает окна так же, как _shazam_windows: пропуская смещения за концом записи"""
+    payload = sent = 0
+    for offset in CLIP_OFFSETS:
+        clip = extract_clip(path, offset)
+        if clip is None:
+            continue
+        payload += len(clip)
+        sent += 1
+        if sent == count:
+            break
+    return payload
+
+
+def legacy_recognize(path: str) -> int:
+    """Прежний recognize_song без сети: хеш, отпечаток и весь файл для Shazam"""
+    file_sha256(path)
+    shazam.audio_fingerprint(AudioSegment.from_file(path, duration=20).set_channels(1))
+    return full_file(path)
+
+
+def recognize(path: str, match_rate: float) -> int:
+    """recognize_song целиком; возвращает объём, переданный в Shazam"""
+    config = FakesConfig(shazam=LatencyModel(median_ms=0), match_rate=match_rate)
+    fake = shazam.shazam = FakeShazam(config)
+    payload = 0
+    recognize_call = fake.recognize
+
+    async def counting(data):
+        nonlocal payload
+        payload += len(data) if isinstance(data, bytes) else os.path.getsize(data)
+        return await recognize_call(data)
+
+    fake.recognize = counting
+    asyncio.run(recognize_song(path))
+    return payload
+
+
+def measure(func, *args) -> dict:
+    tracemalloc.start()
+    started = time.process_time()
+    payload = func(*args)
+    cpu = time.process_time() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"cpu_ms": round(cpu * 1000, 1), "peak_mb": round(peak / 2 ** 20, 1),
+            "payload_kb": round(payload / 1024)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--minutes", type=float, nargs="+", default=[0.5, 3, 10])
+    args = parser.parse_args()
+    # Импорт numpy при первом отпечатке не должен попадать в замеры
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        pass
+
+    report = []
+    with tempfile.TemporaryDirectory(prefix="soundhome_clips_") as tmp:
+        for minutes in args.minutes:
+            path = os.path.join(tmp, f"{minutes:g}min.wav")
+            write_wav(path, minutes * 60)
+            # recognize_song кэширует результат по хешу: каждому прогону свой файл
+            match_path = os.path.join(tmp, f"{minutes:g}min_match.wav")
+            miss_path = os.path.join(tmp, f"{minutes:g}min_miss.wav")
+            write_wav(match_path, minutes * 60)
+            write_wav(miss_path, minutes * 60)
+            row = {
+                "minutes": minutes,
+                "file_mb": round(os.path.getsize(path) / 2 ** 20, 1),
+                "full_file": measure(full_file, path),
+                "first_window": measure(windows, path, 1),
+                "all_windows": measure(windows, path, len(CLIP_OFFSETS)),
+                "legacy_recognize_song": measure(legacy_recognize, path),
+                "recognize_song_match": measure(recognize, match_path, 1.0),
+                "recognize_song_miss": measure(recognize, miss_path, 0.0),
+            }
+            row["cpu_speedup"] = round(row["full_file"]["cpu_ms"] / max(row["first_window"]["cpu_ms"], 0.1), 1)
+            row["end_to_end_speedup"] = round(
+                row["legacy_recognize_song"]["cpu_ms"] / max(row["recognize_song_match"]["cpu_ms"], 0.1), 1
+            )
+            report.append(row)
+    async_database.shutdown()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Нагрузочный тест /api/recognize: N параллельных загрузок по M МБ.
+
+Сервер запускается отдельным процессом с подменёнными Shazam и поиском,
+поэтому измеряется только приём и сохранение загрузки. Пиковый RSS сервера
+берётся из /proc/<pid>/status (VmHWM), поэтому скрипт рассчитан на Linux.
+
+    python benchmarks/bench_upload.py --clients 50 --size-mb 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SERVER_CODE = """
+import sys, uvicorn
+sys.path.insert(0, {root!r})
+import app.main as main
+import app.pipeline as pipeline
+
+async def fake_recognize(path, content_hash=None):
+    return {{"title": "Bench", "artist": "Bench", "genres": "", "shazam_url": ""}}
+
+async def fake_search(title, artist):
+    return None
+
+pipeline.recognize_song = fake_recognize
+pipeline.search_track_async = fake_search
+uvicorn.run(main.app, host="127.0.0.1", port={port}, log_level="warning")
+"""
+
+
+def read_peak_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def make_payload(size_mb: int) -> bytes:
+    header = b"RIFF" + (size_mb * 1024 * 1024).to_bytes(4, "little") + b"WAVE"
+    return header + os.urandom(size_mb * 1024 * 1024 - len(header))
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str) -> None:
+    for _ in range(100):
+        try:
+            await client.get(url)
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Сервер не запустился")
+
+
+async def run(clients: int, size_mb: int, port: int) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="soundhome_bench_"))
+    (workdir / "templates").symlink_to(ROOT / "templates")
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVER_CODE.format(root=str(ROOT), port=port)],
+        cwd=workdir,
+        stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    payload = make_payload(size_mb)
+
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+            await wait_ready(client, "/")
+            idle_rss = read_peak_rss_mb(server.pid)
+
+            async def upload(i: int) -> float:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/api/recognize",
+                    files={"file": ("clip.wav", payload, "audio/wav")},
+                )
+                response.raise_for_status()
+                return time.perf_counter() - start
+
+            started = time.perf_counter()
+            latencies = sorted(await asyncio.gather(*(upload(i) for i in range(clients))))
+            wall = time.perf_counter() - started
+
+        return {
+            "clients": clients,
+            "size_mb": size_mb,
+            "wall_s": round(wall, 3),
+            "latency_p50_s": round(statistics.median(latencies), 3),
+            "latency_p95_s": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+            "latency_max_s": round(latencies[-1], 3),
+            "server_rss_idle_mb": round(idle_rss, 1),
+            "server_rss_peak_mb": round(read_peak_rss_mb(server.pid), 1),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--size-mb", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.clients, args.size_mb, args.port)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
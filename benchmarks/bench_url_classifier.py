@@ -0,0 +1,100 @@
+"""Микробенчмарк классификации URL результатов поиска.
+
+Сравнивает прежнюю схему из duckduckgo.py (is_music_url с перебором
+регулярных выражений, повторный перебор для источника, нормализация через
+re.sub) с app.platforms.classify_url на одном и том же наборе URL.
+
+    python benchmarks/bench_url_classifier.py --count 100000
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.platforms import classify_url  # noqa: E402
+
+LEGACY_PLATFORMS = {
+    "YouTube": r"youtube\.com|youtu\.be",
+    "Spotify": r"spotify\.com",
+    "Apple Music": r"music\.apple\.com",
+    "Deezer": r"deezer\.com",
+    "Yandex Music": r"music\.yandex\.(ru|com)",
+    "SoundCloud": r"soundcloud\.com",
+    "VK Music": r"vk\.com/music",
+    "Bandcamp": r"bandcamp\.com",
+    "Tidal": r"tidal\.com",
+    "Amazon Music": r"amazon\.com/music"
+}
+
+SAMPLE_URLS = [
+    "https://www.youtube.com/watch?v={n}",
+    "https://youtu.be/{n}",
+    "https://open.spotify.com/track/{n}",
+    "https://music.apple.com/us/album/song/{n}?i={n}",
+    "https://www.deezer.com/en/track/{n}",
+    "https://music.yandex.ru/album/1/track/{n}",
+    "https://soundcloud.com/artist/track-{n}",
+    "https://vk.com/music/album/-{n}_1",
+    "https://artist.bandcamp.com/track/song-{n}",
+    "https://tidal.com/browse/track/{n}",
+    "https://www.amazon.com/music/player/tracks/{n}",
+    "https://en.wikipedia.org/wiki/Song_{n}",
+    "https://genius.com/artist-song-{n}-lyrics",
+    "https://www.reddit.com/r/music/comments/{n}",
+    "https://www.last.fm/music/artist/_/song-{n}",
+    "https://example.com/blog/{n}",
+]
+
+
+def legacy_classify(url: str):
+    if not any(re.search(pattern, url) for pattern in LEGACY_PLATFORMS.values()):
+        return None
+    source = next((name for name, pattern in LEGACY_PLATFORMS.items()
+                   if re.search(pattern, url)), "Other Music")
+    if source == "VK Music":
+        url = re.sub(r'(vk\.com/)(audio|music/album)(-?\d+_\d+)', r'\1music/album/\3', url)
+    elif source == "Yandex Music":
+        url = re.sub(r'(track/)\d+', r'\1', url)
+    return source, url
+
+
+def new_classify(url: str):
+    match = classify_url(url)
+    return (match.platform, match.url) if match else None
+
+
+def measure(func, urls) -> float:
+    start = time.perf_counter()
+    for url in urls:
+        func(url)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    urls = [rng.choice(SAMPLE_URLS).format(n=rng.randrange(10 ** 9)) for _ in range(args.count)]
+
+    mismatches = sum(1 for url in urls if legacy_classify(url) != new_classify(url))
+    legacy = measure(legacy_classify, urls)
+    new = measure(new_classify, urls)
+    print(json.dumps({
+        "urls": args.count,
+        "legacy_s": round(legacy, 3),
+        "classify_url_s": round(new, 3),
+        "speedup": round(legacy / new, 2),
+        "mismatches": mismatches,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
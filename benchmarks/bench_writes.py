@@ -0,0 +1,94 @@
+"""Пропускная способность вставок: по одной транзакции на строку против отложенной записи.
+
+Во временной базе N конкурентных корутин вставляют комментарии и треки
+через прежние async_database.add_comment / save_track и через
+app.writebehind.WriteBehindQueue (комментарии с ожиданием записи, треки
+без ожидания, с дозаписью при остановке).
+
+    python benchmarks/bench_writes.py --rows 5000 --concurrency 50 --synchronous FULL
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ["SOUNDHOME_DB"] = os.path.join(tempfile.mkdtemp(prefix="soundhome_writes_"), "bench.sqlite")
+
+from app import async_database, database  # noqa: E402
+from app.writebehind import WriteBehindQueue  # noqa: E402
+
+
+def prepare() -> None:
+    with database.db_connection() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO users (username, login, password) VALUES ('bench', 'benchuser', 'x')"
+        )
+    database.save_track(1, "Bench", "Bench", False)
+    with database.db_connection() as conn:
+        conn.execute(
+            "INSERT INTO discussions (track_id, created_by, title) VALUES (1, 1, 'Bench')"
+        )
+
+
+async def drive(rows: int, concurrency: int, insert) -> float:
+    counter = iter(range(rows))
+
+    async def worker() -> None:
+        for i in counter:
+            await insert(i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+async def run(rows: int, concurrency: int) -> dict:
+    report = {"rows": rows, "concurrency": concurrency}
+
+    elapsed = await drive(rows, concurrency, lambda i: async_database.add_comment(1, 1, f"direct {i}"))
+    report["comments_direct_rps"] = round(rows / elapsed)
+
+    queue = WriteBehindQueue()
+    await queue.start()
+    elapsed = await drive(rows, concurrency, lambda i: queue.add_comment(1, 1, f"batched {i}"))
+    await queue.stop()
+    report["comments_write_behind_rps"] = round(rows / elapsed)
+
+    elapsed = await drive(rows, concurrency, lambda i: async_database.save_track(1, f"direct {i}", "Bench", False))
+    report["tracks_direct_rps"] = round(rows / elapsed)
+
+    queue = WriteBehindQueue()
+    await queue.start()
+    started = time.perf_counter()
+    await drive(rows, concurrency, lambda i: queue.save_track(1, f"batched {i}", "Bench", False))
+    await queue.stop()
+    report["tracks_write_behind_rps"] = round(rows / (time.perf_counter() - started))
+
+    report["comments_speedup"] = round(report["comments_write_behind_rps"] / report["comments_direct_rps"], 1)
+    report["tracks_speedup"] = round(report["tracks_write_behind_rps"] / report["tracks_direct_rps"], 1)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--synchronous", choices=["OFF", "NORMAL", "FULL"], default="NORMAL",
+                        help="PRAGMA synchronous: FULL синхронизирует WAL на диск при каждом коммите")
+    args = parser.parse_args()
+
+    database.CONNECTION_PRAGMAS.append(f"PRAGMA synchronous = {args.synchronous}")
+
+    prepare()
+    report = asyncio.run(run(args.rows, args.concurrency))
+    async_database.shutdown()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Локальные заменители Shazam и DuckDuckGo для нагрузочных прогонов.
+
+Подменяются только внешние вызовы — shazam.recognize и DDGS.text, — поэтому
+кэш, отпечатки, single-flight, лимитер и пулы потоков приложения работают
+как в бою. Задержка берётся из логнормального распределения с заданной
+медианой, ошибки — с заданной вероятностью. Конфигурация передаётся
+серверному процессу через переменную окружения SOUNDHOME_BENCH_FAKES (JSON).
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Union
+
+FAKES_ENV = "SOUNDHOME_BENCH_FAKES"
+
+FAKE_SEARCH_URLS = [
+    "https://www.youtube.com/watch?v={n}",
+    "https://open.spotify.com/track/{n}",
+    "https://music.yandex.ru/album/1/track/{n}",
+    "https://soundcloud.com/bench/track-{n}",
+    "https://en.wikipedia.org/wiki/Bench_{n}",
+    "https://example.com/blog/{n}",
+]
+
+
+@dataclass
+class LatencyModel:
+    """Логнормальная задержка с медианой median_ms и разбросом sigma, плюс доля ошибок"""
+    median_ms: float = 0.0
+    sigma: float = 0.5
+    error_rate: float = 0.0
+
+    def delay(self, rng: random.Random) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        return rng.lognormvariate(math.log(self.median_ms / 1000), self.sigma)
+
+    def fails(self, rng: random.Random) -> bool:
+        return rng.random() < self.error_rate
+
+
+@dataclass
+class FakesConfig:
+    shazam: LatencyModel = field(default_factory=lambda: LatencyModel(median_ms=800))
+    search: LatencyModel = field(default_factory=lambda: LatencyModel(median_ms=600))
+    # Доля распознанных файлов; остальные Shazam «не узнаёт»
+    match_rate: float = 0.9
+    # Сколько разных треков «знает» Shazam: влияет на попадания в кэш поиска
+    distinct_tracks: int = 200
+    # Скорость общего лимитера поиска; None — оставить боевые настройки
+    search_rate: Optional[float] = 1000.0
+    seed: int = 1
+
+    def to_env(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_env(cls, value: str) -> "FakesConfig":
+        data = json.loads(value)
+        data["shazam"] = LatencyModel(**data["shazam"])
+        data["search"] = LatencyModel(**data["search"])
+        return cls(**data)
+
+
+class FakeShazam:
+    """Заменитель shazamio.Shazam.recognize: принимает путь или байты окна"""
+
+    def __init__(self, config: FakesConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.calls = 0
+
+    async def recognize(self, data: Union[str, bytes]) -> Dict[str, Any]:
+        self.calls += 1
+        await asyncio.sleep(self.config.shazam.delay(self.rng))
+        if self.config.shazam.fails(self.rng):
+            raise ConnectionError("fake shazam: upstream error")
+
+        if isinstance(data, (bytes, bytearray)):
+            head = hashlib.sha256(data[:64 * 1024]).digest()
+        else:
+            with open(data, "rb") as f:
+                head = hashlib.sha256(f.read(64 * 1024)).digest()
+        number = int.from_bytes(head[:8], "big")
+        if (number % 1000) / 1000 >= self.config.match_rate:
+            return {"matches": []}
+        track = number % self.config.distinct_tracks
+        return {
+            "track": {
+                "title": f"Bench Track {track}",
+                "subtitle": f"Bench Artist {track % 50}",
+                "genres": {"primary": "Electronic"},
+                "url": f"https://www.shazam.com/track/{track}",
+            }
+        }
+
+
+class FakeDDGS:
+    """Заменитель duckduckgo_search.DDGS с синхронным text()"""
+
+    config: FakesConfig = FakesConfig()
+    rng = random.Random(1)
+    calls = 0
+
+    def __init__(self, *args, **kwargs) -> None:
+        pass
+
+    def __enter__(self) -> "FakeDDGS":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+    def text(self, query: str, max_results: int = 20, **options) -> List[Dict[str, str]]:
+        from duckduckgo_search.exceptions import RatelimitException
+
+        cls = type(self)
+        cls.calls += 1
+        time.sleep(self.config.search.delay(self.rng))
+        if self.config.search.fails(self.rng):
+            raise RatelimitException("fake ddgs: rate limited")
+
+        seed = int.from_bytes(hashlib.sha256(query.encode()).digest()[:4], "big")
+        return [
+            {
+                "title": f"{query} - result {i}",
+                "href": FAKE_SEARCH_URLS[(seed + i) % len(FAKE_SEARCH_URLS)].format(n=seed + i),
+                "body": "",
+            }
+            for i in range(min(max_results, 8))
+        ]
+
+
+def install(config: FakesConfig) -> None:
+    """Подменяет внешние сервисы в уже импортированном приложении"""
+    import app.providers as providers
+    import app.shazam as shazam_module
+    from app.ratelimit import search_rate_limiter
+
+    shazam_module.shazam = FakeShazam(config)
+    FakeDDGS.config = config
+    FakeDDGS.rng = random.Random(config.seed + 1)
+    providers.DDGS = FakeDDGS
+
+    if config.search_rate is not None:
+        search_rate_limiter.initial_rate = config.search_rate
+        search_rate_limiter.max_rate = config.search_rate
+        search_rate_limiter.burst = config.search_rate
+
+
+def install_from_env() -> FakesConfig:
+    config = FakesConfig.from_env(os.environ[FAKES_ENV]) if FAKES_ENV in os.environ else FakesConfig()
+    install(config)
+    return config
@@ -0,0 +1,349 @@
+"""Нагрузочный прогон SoundHome со сценариями и отчётом в JSON.
+
+Сервер запускается отдельным процессом на заранее заполненной базе
+(benchmarks/seed_db.py) с локальными заменителями Shazam и DuckDuckGo
+(benchmarks/fakes.py). Сценарии выполняются одновременно, каждый своим
+числом клиентов, в течение --duration секунд:
+
+    recognize  POST /api/recognize и ожидание готовности задачи
+    forum      GET /forum
+    comment    POST /forum/{id}/comment от имени тестового пользователя
+    admin      GET /admin от имени администратора
+
+Отчёт (p50/p95/p99, RPS, ошибки, RSS сервера, средние по этапам из /metrics)
+пишется в --output; --compare печатает отношение к прошлому отчёту.
+
+    python benchmarks/loadtest.py --duration 30 --output report.json
+    python benchmarks/loadtest.py --scenarios forum,admin --compare report.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from bench_upload import make_payload, read_peak_rss_mb, wait_ready
+from fakes import FAKES_ENV, FakesConfig, LatencyModel
+from seed_db import bench_login, seed_database
+
+ROOT = Path(__file__).resolve().parent.parent
+SCENARIOS = ("recognize", "forum", "comment", "admin")
+JOB_POLL_SECONDS = 0.05
+
+SERVER_CODE = """
+import sys, uvicorn
+sys.path.insert(0, {root!r})
+import app.main as main
+from benchmarks.fakes import install_from_env
+
+install_from_env()
+uvicorn.run(main.app, host="127.0.0.1", port={port}, log_level="warning")
+"""
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Перцентиль по ближайшему рангу"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def read_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Recorder:
+    """Собирает задержки и ошибки по именам операций"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def ok(self, name: str, seconds: float) -> None:
+        self.latencies.setdefault(name, []).append(seconds)
+
+    def fail(self, name: str) -> None:
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, duration: float) -> Dict[str, dict]:
+        result = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(name, []))
+            result[name] = {
+                "requests": len(values),
+                "errors": self.errors.get(name, 0),
+                "rps": round(len(values) / duration, 2),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+            }
+        return result
+
+
+async def timed(recorder: Recorder, name: str, request) -> Optional[httpx.Response]:
+    start = time.perf_counter()
+    try:
+        response = await request
+    except httpx.HTTPError:
+        recorder.fail(name)
+        return None
+    if response.status_code >= 400:
+        recorder.fail(name)
+    else:
+        recorder.ok(name, time.perf_counter() - start)
+    return response
+
+
+async def login(client: httpx.AsyncClient, user: str, password: str) -> None:
+    response = await client.post("/login", data={"login": user, "password": password})
+    if response.status_code != 303:
+        raise RuntimeError(f"Не удалось войти как {user}: {response.status_code}")
+
+
+async def recognize_worker(client: httpx.AsyncClient, recorder: Recorder, deadline: float,
+                           payloads: List[bytes], rng: random.Random) -> None:
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await timed(recorder, "recognize_submit", client.post(
+            "/api/recognize", files={"file": ("clip.wav", rng.choice(payloads), "audio/wav")}
+        ))
+        if response is None or response.status_code != 202:
+            await asyncio.sleep(0.1)
+            continue
+        status_url = response.json()["status_url"]
+        while True:
+            await asyncio.sleep(JOB_POLL_SECONDS)
+            job = await client.get(status_url)
+            status = job.json()["status"] if job.status_code == 200 else "failed"
+            if status in ("done", "failed"):
+                break
+        if status == "done":
+            recorder.ok("recognize_e2e", time.perf_counter() - start)
+        else:
+            recorder.fail("recognize_e2e")
+
+
+async def forum_worker(client: httpx.AsyncClient, recorder: Recorder, deadline: float) -> None:
+    while time.perf_counter() < deadline:
+        await timed(recorder, "forum", client.get("/forum"))
+
+
+async def comment_worker(client: httpx.AsyncClient, recorder: Recorder, deadline: float,
+                         discussions: int, rng: random.Random) -> None:
+    while time.perf_counter() < deadline:
+        discussion_id = rng.randint(1, discussions)
+        await timed(recorder, "comment", client.post(
+            f"/forum/{discussion_id}/comment", data={"content": f"Нагрузочный комментарий {rng.random()}"}
+        ))
+
+
+async def admin_worker(client: httpx.AsyncClient, recorder: Recorder, deadline: float) -> None:
+    while time.perf_counter() < deadline:
+        await timed(recorder, "admin", client.get("/admin"))
+
+
+def stage_means(metrics_text: str) -> Dict[str, float]:
+    """Средняя длительность этапов из soundhome_stage_seconds, мс"""
+    sums: Dict[str, float] = {}
+    counts: Dict[str, float] = {}
+    for line in metrics_text.splitlines():
+        for suffix, target in (("_sum", sums), ("_count", counts)):
+            prefix = f"soundhome_stage_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                stage, _, value = line[len(prefix):].partition("\"} ")
+                target[stage] = float(value)
+    return {stage: round(sums[stage] / counts[stage] * 1000, 2)
+            for stage in sums if counts.get(stage)}
+
+
+async def run(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="soundhome_load_"))
+    (workdir / "templates").symlink_to(ROOT / "templates")
+    db_path = workdir / "music_db.sqlite"
+    if args.db:
+        shutil.copy(args.db, db_path)
+        seeded = {"source": args.db}
+    else:
+        seeded = seed_database(str(db_path), args.users, args.tracks_per_user,
+                               args.discussions, args.comments_per_discussion, args.seed)
+
+    fakes = FakesConfig(
+        shazam=LatencyModel(args.shazam_ms, args.latency_sigma, args.shazam_error_rate),
+        search=LatencyModel(args.search_ms, args.latency_sigma, args.search_error_rate),
+        match_rate=args.match_rate,
+        distinct_tracks=args.distinct_tracks,
+        search_rate=None if args.real_rate_limit else 1000.0,
+        seed=args.seed,
+    )
+    env = dict(
+        os.environ,
+        SOUNDHOME_DB=str(db_path),
+        SOUNDHOME_RATELIMIT_DB=str(workdir / "ratelimit.sqlite"),
+        **{FAKES_ENV: fakes.to_env()},
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVER_CODE.format(root=str(ROOT), port=args.port)],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    rng = random.Random(args.seed)
+    payloads = [make_payload(args.size_mb) for _ in range(args.distinct_files)]
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=120) as probe:
+            await wait_ready(probe, "/")
+        idle_rss = read_rss_mb(server.pid)
+
+        clients: List[httpx.AsyncClient] = []
+
+        async def new_client(user: str = None, password: str = None) -> httpx.AsyncClient:
+            client = httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits)
+            clients.append(client)
+            if user:
+                await login(client, user, password)
+            return client
+
+        try:
+            # Клиенты и входы готовятся заранее, чтобы не попасть в замер
+            prepared = []
+            for scenario in args.scenarios:
+                for i in range(args.clients):
+                    if scenario == "comment":
+                        client = await new_client(bench_login(i % args.users + 1), "bench")
+                    elif scenario == "admin":
+                        client = await new_client("admin1", "1")
+                    else:
+                        client = await new_client()
+                    prepared.append((scenario, client, random.Random(rng.random())))
+
+            deadline = time.perf_counter() + args.duration
+            workers = []
+            for scenario, client, worker_rng in prepared:
+                if scenario == "recognize":
+                    workers.append(recognize_worker(client, recorder, deadline, payloads, worker_rng))
+                elif scenario == "forum":
+                    workers.append(forum_worker(client, recorder, deadline))
+                elif scenario == "comment":
+                    workers.append(comment_worker(client, recorder, deadline, args.discussions, worker_rng))
+                else:
+                    workers.append(admin_worker(client, recorder, deadline))
+
+            started = time.perf_counter()
+            await asyncio.gather(*workers)
+            elapsed = time.perf_counter() - started
+            metrics_text = (await clients[0].get("/metrics")).text if clients else ""
+        finally:
+            await asyncio.gather(*(client.aclose() for client in clients))
+
+        return {
+            "commit": git_commit(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {
+                key: value for key, value in vars(args).items()
+                if key not in ("output", "compare", "port")
+            },
+            "seeded": seeded,
+            "duration_s": round(elapsed, 2),
+            "scenarios": recorder.summary(elapsed),
+            "server_rss_idle_mb": round(idle_rss, 1),
+            "server_rss_end_mb": round(read_rss_mb(server.pid), 1),
+            "server_rss_peak_mb": round(read_peak_rss_mb(server.pid), 1),
+            "stage_mean_ms": stage_means(metrics_text),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(report: dict, baseline: dict) -> Dict[str, dict]:
+    """Отношения RPS и p95 текущего прогона к прошлому (>1 — больше, чем было)"""
+    result = {}
+    for name, current in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        result[name] = {
+            "rps_ratio": round(current["rps"] / before["rps"], 3) if before["rps"] else None,
+            "p95_ratio": round(current["p95_ms"] / before["p95_ms"], 3) if before["p95_ms"] else None,
+        }
+    if baseline.get("server_rss_peak_mb"):
+        result["server_rss_peak_ratio"] = round(
+            report["server_rss_peak_mb"] / baseline["server_rss_peak_mb"], 3
+        )
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="через запятую: " + ", ".join(SCENARIOS))
+    parser.add_argument("--clients", type=int, default=10, help="клиентов на каждый сценарий")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--db", help="готовая база (копируется); иначе создаётся seed_db")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--tracks-per-user", type=int, default=5)
+    parser.add_argument("--discussions", type=int, default=500)
+    parser.add_argument("--comments-per-discussion", type=int, default=20)
+    parser.add_argument("--size-mb", type=int, default=2, help="размер загружаемого файла")
+    parser.add_argument("--distinct-files", type=int, default=20)
+    parser.add_argument("--shazam-ms", type=float, default=800)
+    parser.add_argument("--shazam-error-rate", type=float, default=0.02)
+    parser.add_argument("--search-ms", type=float, default=600)
+    parser.add_argument("--search-error-rate", type=float, default=0.05)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--match-rate", type=float, default=0.9)
+    parser.add_argument("--distinct-tracks", type=int, default=200)
+    parser.add_argument("--real-rate-limit", action="store_true",
+                        help="не ослаблять общий лимитер поиска")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="куда записать отчёт JSON")
+    parser.add_argument("--compare", help="прошлый отчёт для сравнения")
+    args = parser.parse_args()
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    report = asyncio.run(run(args))
+    if args.compare:
+        with open(args.compare) as f:
+            report["compare"] = compare(report, json.load(f))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
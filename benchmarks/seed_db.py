@@ -0,0 +1,124 @@
+"""Заполняет базу SoundHome детерминированными тестовыми данными.
+
+Схема создаётся теми же миграциями, что и в приложении; пользователи
+получают логины benchuser00001..., пароль "bench". Один и тот же seed
+даёт одну и ту же базу, поэтому результаты нагрузочных прогонов сравнимы.
+
+    python benchmarks/seed_db.py bench.sqlite --users 1000 --discussions 500
+"""
+import argparse
+import json
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.migrations import apply_migrations  # noqa: E402
+from app.normalize import normalize_key  # noqa: E402
+
+BENCH_PASSWORD = "bench"
+START_TIME = datetime(2024, 1, 1)
+
+
+def bench_login(i: int) -> str:
+    return f"benchuser{i:05d}"
+
+
+def _timestamps(rng: random.Random, count: int, span: timedelta):
+    step = span / max(count, 1)
+    moment = START_TIME
+    for _ in range(count):
+        moment += step * rng.uniform(0.5, 1.5)
+        yield moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def seed_database(path: str, users: int = 1000, tracks_per_user: int = 5,
+                  discussions: int = 500, comments_per_discussion: int = 20,
+                  seed: int = 1) -> dict:
+    """Создаёт и заполняет базу; возвращает число строк по таблицам"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        apply_migrations(conn)
+        conn.execute("PRAGMA synchronous = OFF")
+
+        conn.executemany(
+            "INSERT INTO users (username, login, password, created_at) VALUES (?, ?, ?, ?)",
+            ((f"user_{bench_login(i)}", bench_login(i), BENCH_PASSWORD, created_at)
+             for i, created_at in enumerate(_timestamps(rng, users, timedelta(days=30)), 1))
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO users (username, login, password, is_admin) VALUES (?, ?, ?, ?)",
+            ("admin", "admin1", "1", True)
+        )
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users")]
+
+        track_count = users * tracks_per_user
+        finds = [(f"Track {rng.randrange(track_count)}", f"Artist {rng.randrange(users)}",
+                  rng.random() < 0.3, rng.choice(user_ids), found_at)
+                 for found_at in _timestamps(rng, track_count, timedelta(days=60))]
+        conn.executemany(
+            "INSERT OR IGNORE INTO catalog (norm_key, title, artist) VALUES (?, ?, ?)",
+            ((normalize_key(artist, title), title, artist) for title, artist, *_ in finds)
+        )
+        conn.executemany(
+            """INSERT OR IGNORE INTO tracks (catalog_id, is_original, found_by, found_at)
+            SELECT id, ?, ?, ? FROM catalog WHERE norm_key = ?""",
+            ((is_original, user_id, found_at, normalize_key(artist, title))
+             for title, artist, is_original, user_id, found_at in finds)
+        )
+        track_ids = [row[0] for row in conn.execute("SELECT id FROM tracks")]
+
+        if track_ids:
+            conn.executemany(
+                """INSERT INTO discussions (track_id, created_by, title, created_at)
+                VALUES (?, ?, ?, ?)""",
+                ((rng.choice(track_ids), rng.choice(user_ids), f"Обсуждение {i}", created_at)
+                 for i, created_at in enumerate(_timestamps(rng, discussions, timedelta(days=60))))
+            )
+        discussion_ids = [row[0] for row in conn.execute("SELECT id FROM discussions")]
+
+        if discussion_ids:
+            conn.executemany(
+                """INSERT INTO comments (discussion_id, user_id, content, created_at)
+                VALUES (?, ?, ?, ?)""",
+                ((rng.choice(discussion_ids), rng.choice(user_ids), f"Комментарий {i}", created_at)
+                 for i, created_at in enumerate(_timestamps(
+                     rng, discussions * comments_per_discussion, timedelta(days=60)
+                 )))
+            )
+        conn.commit()
+        conn.execute("ANALYZE")
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("users", "catalog", "tracks", "discussions", "comments")
+        }
+    finally:
+        conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--tracks-per-user", type=int, default=5)
+    parser.add_argument("--discussions", type=int, default=500)
+    parser.add_argument("--comments-per-discussion", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if Path(args.path).exists():
+        parser.error(f"{args.path} уже существует")
+    started = time.perf_counter()
+    counts = seed_database(args.path, args.users, args.tracks_per_user,
+                           args.discussions, args.comments_per_discussion, args.seed)
+    print(json.dumps({**counts, "seconds": round(time.perf_counter() - started, 2)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# app.database при импорте создаёт и мигрирует базу SOUNDHOME_DB: тесты
+# работают с временной базой, рабочая music_db.sqlite не затрагивается
+os.environ["SOUNDHOME_DB"] = os.path.join(tempfile.mkdtemp(prefix="soundhome_test_"), "test.sqlite")
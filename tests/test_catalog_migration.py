@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+from app import migrations
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    """База версии 5 с повторными и по-разному написанными находками"""
+    conn = sqlite3.connect(tmp_path / "v5.sqlite")
+    conn.row_factory = sqlite3.Row
+    monkeypatch.setattr(migrations, "MIGRATIONS", [m for m in migrations.MIGRATIONS if m[0] <= 5])
+    assert migrations.apply_migrations(conn) == 5
+    monkeypatch.undo()
+
+    conn.executescript(
+        """
+        INSERT INTO users (id, username, login, password) VALUES
+            (1, 'user_alice', 'alice', 'x'),
+            (2, 'user_bob', 'bob', 'x');
+        INSERT INTO tracks (id, title, artist, is_original, found_by, found_at) VALUES
+            (1, 'Around the World', 'Daft Punk', 0, 1, '2020-01-01 00:00:00'),
+            (2, 'around the world!', 'DAFT  PUNK', 1, 2, '2020-01-02 00:00:00'),
+            (3, 'Around The World', 'daft punk', 1, 1, '2020-01-03 00:00:00'),
+            (4, 'One More Time', 'Daft Punk', 0, 1, '2020-01-04 00:00:00');
+        INSERT INTO discussions (id, track_id, created_by, title) VALUES
+            (1, 3, 1, 'О повторной находке'),
+            (2, 2, 2, 'О находке Боба');
+        """
+    )
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_catalog_migration_merges_finds(conn):
+    assert migrations.apply_migrations(conn) == migrations.MIGRATIONS[-1][0]
+
+    catalog = {
+        row["norm_key"]: dict(row)
+        for row in conn.execute("SELECT id, norm_key, title, artist, found_count FROM catalog")
+    }
+    assert set(catalog) == {"daft punk|around the world", "daft punk|one more time"}
+    around = catalog["daft punk|around the world"]
+    # Написание — из самой ранней находки, счётчик — число разных пользователей
+    assert (around["title"], around["artist"], around["found_count"]) == ("Around the World", "Daft Punk", 2)
+    assert catalog["daft punk|one more time"]["found_count"] == 1
+
+    tracks = {row["id"]: dict(row) for row in conn.execute("SELECT * FROM tracks")}
+    # Повторная находка Алисы (3) слита в первую (1)
+    assert set(tracks) == {1, 2, 4}
+    assert tracks[1]["catalog_id"] == tracks[2]["catalog_id"] == around["id"]
+    assert tracks[1]["found_by"] == 1 and tracks[2]["found_by"] == 2
+    assert tracks[1]["is_original"] == 1
+    assert tracks[1]["found_at"] == "2020-01-01 00:00:00"
+
+    discussions = dict(conn.execute("SELECT id, track_id FROM discussions").fetchall())
+    assert discussions == {1: 1, 2: 2}
+
+    # Триггеры поддерживают found_count после миграции
+    conn.execute("DELETE FROM tracks WHERE id = 2")
+    assert conn.execute(
+        "SELECT found_count FROM catalog WHERE id = ?", (around["id"],)
+    ).fetchone()[0] == 1
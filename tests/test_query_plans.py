@@ -0,0 +1,52 @@
+from typing import List
+
+import pytest
+
+from app import database
+
+CURSOR = database.encode_cursor("2000-01-01 00:00:00", 1)
+
+# Горячие запросы страниц: первая страница, следующая и предыдущая по курсору
+HOT_CALLS = {
+    "get_user_tracks": lambda: database.get_user_tracks(1),
+    "get_all_discussions": lambda: database.get_all_discussions(),
+    "get_all_discussions_next": lambda: database.get_all_discussions(CURSOR, "next"),
+    "get_all_discussions_prev": lambda: database.get_all_discussions(CURSOR, "prev"),
+    "get_comments": lambda: database.get_comments(1),
+    "get_comments_next": lambda: database.get_comments(1, CURSOR, "next"),
+    "get_comments_prev": lambda: database.get_comments(1, CURSOR, "prev"),
+    "get_all_comments": lambda: database.get_all_comments(),
+    "get_all_comments_next": lambda: database.get_all_comments(CURSOR, "next"),
+    "get_all_comments_prev": lambda: database.get_all_comments(CURSOR, "prev"),
+}
+
+
+def unindexed_steps(plan: List[str]) -> List[str]:
+    """Шаги плана с полным сканом таблицы или временной сортировкой"""
+    return [
+        step for step in plan
+        if "TEMP B-TREE" in step
+        or (step.startswith("SCAN") and "USING" not in step)
+    ]
+
+
+def traced_selects(call) -> List[str]:
+    """SELECT-запросы, которые выполнила функция database.py, с подставленными параметрами"""
+    conn = database.get_db_connection()
+    statements: List[str] = []
+    conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        conn.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().upper().startswith("SELECT")]
+
+
+@pytest.mark.parametrize("name", sorted(HOT_CALLS))
+def test_hot_query_uses_index(name):
+    statements = traced_selects(HOT_CALLS[name])
+    assert statements
+    conn = database.get_db_connection()
+    for sql in statements:
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+        assert unindexed_steps(plan) == [], sql + "\n" + "\n".join(plan)